@@ -0,0 +1,221 @@
+##########################################################################
+# Copyright 2019 Kata.ai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################
+
+from functools import partial
+from pathlib import Path
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from sacred import Ingredient
+import numpy as np
+
+from ingredients.corpus import ing as corpus_ing, list_files, map_corpus, read_corpus
+from ingredients.preprocess import ing as prep_ing, make_prep_sent
+
+ing = Ingredient('cache', ingredients=[corpus_ing, prep_ing])
+
+# bump this whenever the cache layout changes
+CACHE_VERSION = 2
+# corpus and prep configs which don't change the cache content
+IGNORED_CORPUS_KEYS = ('workers', 'chunk_bytes', 'prefetch', 'block_bytes')
+IGNORED_PREP_KEYS = ('cache_size', )
+
+VOCAB_FNAME = 'vocab.json'
+TOKENS_FNAME = 'tokens.u32'
+SENT_OFFSETS_FNAME = 'sent_offsets.u64'
+DOC_OFFSETS_FNAME = 'doc_offsets.u64'
+CONFIG_FNAME = 'config.json'
+
+
+@ing.config
+def default():
+    # whether to cache the preprocessed corpus and read from the cache
+    enabled = False
+    # directory to store the cached corpora in
+    path = 'cache'
+
+
+@ing.capture
+def read_prep_corpus(_log, enabled=False):
+    """Read the corpus as documents, each a list of preprocessed sentences.
+
+    If caching is enabled, the preprocessed corpus is stored once as a vocabulary plus
+    flat token ID arrays keyed by the corpus and preprocessing configs, and read via mmap
+    on subsequent calls.
+    """
+    if not enabled:
+        return _prep_docs(read_corpus(), make_prep_sent(), _log)
+
+    cache_dir = get_cache_dir()
+    _log.info('Reading corpus cache from %s', cache_dir)
+    return read_cache(cache_dir)
+
+
+def format_docs(docs, prep_sent):
+    """Format documents as lines of space-separated preprocessed words, one per document."""
+    lines = []
+    for paras in docs:
+        lines.append(' '.join(' '.join(sent) for sent in prep_sent.prep_doc(paras)))
+    return lines
+
+
+@ing.capture
+def iter_lines(enabled=False):
+    """Iterate over the preprocessed corpus as lines of words, one per document, in corpus
+    order.
+
+    Without the cache, the corpus is read and preprocessed by the corpus worker pool.
+    """
+    if enabled:
+        for sents in read_prep_corpus():
+            yield ' '.join(' '.join(sent) for sent in sents)
+    else:
+        batches = map_corpus(partial(format_docs, prep_sent=make_prep_sent()), ordered=True)
+        for batch in batches:
+            yield from batch
+
+
+@ing.capture
+def get_cache_dir(_log, _run, path='cache'):
+    """Get the cache directory for the current configs, building the cache if needed."""
+    key_config = get_key_config(_run.config)
+    cache_dir = Path(path) / get_key(key_config)
+    if not (cache_dir / CONFIG_FNAME).exists():
+        _log.info('Building corpus cache in %s', cache_dir)
+        build_cache(cache_dir, _prep_docs(read_corpus(), make_prep_sent(), _log), key_config)
+    return cache_dir
+
+
+def get_key_config(config):
+    """Get the configs keying the cache, along with the size and mtime of every corpus file.
+
+    The corpus files are listed from the corpus ingredient, so this must be called during
+    a run.
+    """
+    corpus_config = {k: v for k, v in config['corpus'].items() if k not in IGNORED_CORPUS_KEYS}
+    corpus_config['path'] = str(Path(corpus_config['path']).resolve())
+    if corpus_config.get('sample_rate', 1.0) >= 1:
+        # nothing is sampled, so keep the keys of caches built before sampling was added
+        corpus_config.pop('sample_rate', None)
+        corpus_config.pop('sample_seed', None)
+    prep_config = {k: v for k, v in config['prep'].items() if k not in IGNORED_PREP_KEYS}
+    files = [get_file_fingerprint(path) for _, _, path in list_files()]
+    return {
+        'version': CACHE_VERSION,
+        'corpus': corpus_config,
+        'prep': prep_config,
+        'files': files,
+    }
+
+
+def get_file_fingerprint(path):
+    stat = path.stat()
+    return {'path': str(path.resolve()), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def get_key(key_config):
+    return hashlib.sha1(json.dumps(key_config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _prep_docs(docs, prep_sent, logger):
+    for paras in docs:
+        yield prep_sent.prep_doc(paras)
+    logger.info('Preprocessor cache hit rate: %.2f%%', 100 * prep_sent.hit_rate)
+
+
+def build_cache(cache_dir, docs, key_config):
+    cache_dir = Path(cache_dir)
+    cache_dir.parent.mkdir(parents=True, exist_ok=True)
+    # unique per build, so concurrent builds of the same cache don't clobber each other
+    tmp_dir = Path(tempfile.mkdtemp(prefix=cache_dir.name + '.', dir=cache_dir.parent))
+    # mkdtemp makes the directory private
+    tmp_dir.chmod(0o755)
+    try:
+        _write_cache(tmp_dir, docs, key_config)
+    except BaseException:
+        shutil.rmtree(tmp_dir)
+        raise
+
+    if (cache_dir / CONFIG_FNAME).exists():
+        # another build of the same cache finished first
+        shutil.rmtree(tmp_dir)
+        return
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    try:
+        os.replace(tmp_dir, cache_dir)
+    except OSError:
+        # lost the race to another build, whose cache is just as good
+        shutil.rmtree(tmp_dir)
+        if not (cache_dir / CONFIG_FNAME).exists():
+            raise
+
+
+def _write_cache(tmp_dir, docs, key_config):
+    word2id = {}
+    n_tokens, n_sents = 0, 0
+    with open(tmp_dir / TOKENS_FNAME, 'wb') as f_tok, \
+            open(tmp_dir / SENT_OFFSETS_FNAME, 'wb') as f_sent, \
+            open(tmp_dir / DOC_OFFSETS_FNAME, 'wb') as f_doc:
+        f_sent.write(np.zeros(1, dtype=np.uint64).tobytes())
+        f_doc.write(np.zeros(1, dtype=np.uint64).tobytes())
+        for sents in docs:
+            sent_offsets = []
+            for sent in sents:
+                ids = [word2id.setdefault(w, len(word2id)) for w in sent]
+                f_tok.write(np.array(ids, dtype=np.uint32).tobytes())
+                n_tokens += len(ids)
+                sent_offsets.append(n_tokens)
+            f_sent.write(np.array(sent_offsets, dtype=np.uint64).tobytes())
+            n_sents += len(sent_offsets)
+            f_doc.write(np.array([n_sents], dtype=np.uint64).tobytes())
+
+    # a JSON list rather than a word per line, since words may contain newlines
+    with open(tmp_dir / VOCAB_FNAME, 'w', encoding='utf-8') as f:
+        json.dump(list(word2id), f, ensure_ascii=False)
+    # written last, marks the cache as complete
+    with open(tmp_dir / CONFIG_FNAME, 'w') as f:
+        json.dump(key_config, f, indent=2, sort_keys=True)
+
+
+def _memmap(path, dtype):
+    if path.stat().st_size == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
+
+def open_cache(cache_dir):
+    """Open a corpus cache, returning its vocab, tokens, and sentence and doc offsets."""
+    cache_dir = Path(cache_dir)
+    with open(cache_dir / VOCAB_FNAME, encoding='utf-8') as f:
+        vocab = json.load(f)
+    tokens = _memmap(cache_dir / TOKENS_FNAME, np.uint32)
+    sent_offsets = _memmap(cache_dir / SENT_OFFSETS_FNAME, np.uint64)
+    doc_offsets = _memmap(cache_dir / DOC_OFFSETS_FNAME, np.uint64)
+    return vocab, tokens, sent_offsets, doc_offsets
+
+
+def read_cache(cache_dir):
+    vocab, tokens, sent_offsets, doc_offsets = open_cache(cache_dir)
+    for d in range(len(doc_offsets) - 1):
+        # uint64 plus int is a float64 in numpy, which can't be a slice index
+        start, end = int(doc_offsets[d]), int(doc_offsets[d + 1])
+        offsets = sent_offsets[start:end + 1].tolist()
+        ids = tokens[offsets[0]:offsets[-1]].tolist()
+        offsets = [o - offsets[0] for o in offsets]
+        yield [[vocab[i] for i in ids[a:b]] for a, b in zip(offsets, offsets[1:])]
@@ -14,12 +14,20 @@
 # limitations under the License.
 ##########################################################################
 
-from itertools import chain
+from collections import deque
+from functools import partial
+from itertools import chain, islice
+from multiprocessing import Pool
 from pathlib import Path
 import gzip
+import hashlib
+import io
 import json
+import os
+import queue
 
 from sacred import Ingredient
+import numpy as np
 
 ing = Ingredient('corpus')
 
@@ -40,44 +48,368 @@ def default():
     mbm_end = 2014
     # file encoding to use
     encoding = 'utf-8'
+    # number of worker processes to read the corpus with (1 == read serially)
+    workers = 1
+    # whether to yield documents in the same order as reading serially (only if workers > 1)
+    ordered = True
+    # split files into chunks of roughly this many uncompressed bytes (only if workers > 1)
+    chunk_bytes = 64 * 2**20
+    # max number of chunks per worker read but not consumed yet (only if workers > 1)
+    prefetch = 2
+    # keep this fraction of the documents, chosen by hashing each document line so the
+    # same documents are kept across runs (1.0 == keep all documents)
+    sample_rate = 1.0
+    # seed of the document hash, change it to sample a different subset
+    sample_seed = 0
+    # uncompressed size of the blocks written by the convert_to_bgzf command
+    block_bytes = 256 * 2**10
 
 
 @ing.capture
-def read_corpus(
+def get_year_ranges(
         path,
-        _log,
         product='all',
         kt_begin=2005,
         kt_end=2014,
         mbm_begin=1999,
-        mbm_end=2014,
-        encoding='utf-8'):
+        mbm_end=2014):
+    """Get the (product, corpus directory, begin year, end year) ranges to read."""
     path = Path(path)
 
     if product in ('kt', 'mbm'):
-        path = path / product
         begin, end = (kt_begin, kt_end) if product == 'kt' else (mbm_begin, mbm_end)
-        _log.info('Reading corpus from %s year %s-%s', path, begin, end)
-        return _read(path, begin, end, encoding=encoding)
+        return [(product, path / product, begin, end)]
 
     assert product == 'all', "product must be one of 'kt', 'mbm', or 'all'"
+    return [('kt', path / 'kt', kt_begin, kt_end), ('mbm', path / 'mbm', mbm_begin, mbm_end)]
 
-    _log.info('Reading corpus from %s year %s-%s', path / 'kt', kt_begin, kt_end)
-    kt_corpus = _read(path / 'kt', kt_begin, kt_end, encoding=encoding)
 
-    _log.info('Reading corpus from %s year %s-%s', path / 'mbm', mbm_begin, mbm_end)
-    mbm_corpus = _read(path / 'mbm', mbm_begin, mbm_end, encoding=encoding)
+def list_files():
+    """List the (product, year, path) of every corpus file to read, in reading order."""
+    return [(product, year, _get_path(corpus_dir, year))
+            for product, corpus_dir, begin, end in get_year_ranges()
+            for year in range(begin, end + 1)]
 
-    return chain(kt_corpus, mbm_corpus)
 
+class DocSampler:
+    """Keep a fraction of the documents, chosen by hashing their raw JSON lines.
+
+    Whether a document is kept only depends on its line and the seed, so the same
+    documents are kept across runs and processes regardless of the reading order. Rejected
+    documents are never decoded.
+    """
+
+    def __init__(self, rate=1.0, seed=0):
+        self.rate = rate
+        self.threshold = int(rate * 2**64)
+        self.key = str(seed).encode()
+        self.n_seen = 0
+        self.n_kept = 0
+
+    def __call__(self, line):
+        self.n_seen += 1
+        if self.rate < 1:
+            digest = hashlib.blake2b(
+                line.rstrip(b'\r\n'), digest_size=8, key=self.key).digest()
+            if int.from_bytes(digest, 'little') >= self.threshold:
+                return False
+        self.n_kept += 1
+        return True
+
+
+def _log_sample_size(logger, n_kept, n_seen):
+    logger.info(
+        'Sampled %d of %d documents (%.2f%%)', n_kept, n_seen, 100 * n_kept / max(n_seen, 1))
+
+
+@ing.capture
+def read_corpus(
+        _log,
+        encoding='utf-8',
+        workers=1,
+        ordered=True,
+        chunk_bytes=64 * 2**20,
+        sample_rate=1.0,
+        sample_seed=0):
+    ranges = get_year_ranges()
+    for _, corpus_dir, begin, end in ranges:
+        _log.info('Reading corpus from %s year %s-%s', corpus_dir, begin, end)
+
+    if workers <= 1:
+        sampler = DocSampler(sample_rate, sample_seed)
+        docs = chain.from_iterable(
+            _read(corpus_dir, begin, end, encoding=encoding, sampler=sampler)
+            for _, corpus_dir, begin, end in ranges)
+        return _log_sampled(docs, sampler, _log) if sample_rate < 1 else docs
+
+    return chain.from_iterable(map_corpus(_identity))
+
+
+def _log_sampled(docs, sampler, logger):
+    yield from docs
+    _log_sample_size(logger, sampler.n_kept, sampler.n_seen)
+
+
+@ing.capture
+def map_corpus(
+        fn,
+        _log,
+        encoding='utf-8',
+        workers=1,
+        ordered=True,
+        chunk_bytes=64 * 2**20,
+        prefetch=2,
+        sample_rate=1.0,
+        sample_seed=0):
+    """Apply fn to the list of documents of every corpus chunk, yielding the results.
+
+    Every corpus file is split into chunks of roughly ``chunk_bytes`` uncompressed bytes.
+    If ``workers > 1``, chunks are processed in a process pool so fn must be picklable.
+    At most ``prefetch`` chunks per worker are processed ahead of the consumer.
+    """
+    files = list_files()
+    chunks = (c for _, _, path in files for c in _make_chunks(path, chunk_bytes))
+    chunk_fn = partial(
+        _map_chunk, fn=fn, encoding=encoding, sample_rate=sample_rate, sample_seed=sample_seed)
+
+    if workers <= 1:
+        yield from _unpack_results(map(chunk_fn, chunks), _log, sample_rate)
+        return
+
+    _log.info(
+        'Processing %d files with %d workers (%s)', len(files), workers,
+        'ordered' if ordered else 'unordered')
+    with Pool(workers) as pool:
+        results = _imap_bounded(pool, chunk_fn, chunks, workers * prefetch, ordered=ordered)
+        yield from _unpack_results(results, _log, sample_rate)
+
+
+_END = object()
+
+
+def _imap_bounded(pool, fn, items, max_pending, ordered=True):
+    """Like pool.imap (or imap_unordered), with at most max_pending results not yielded.
+
+    Pool.imap dispatches every item regardless of how fast the results are consumed, so
+    with a slow consumer the results pile up in memory.
+    """
+    items = iter(items)
+    # async results in dispatch order, only kept if ordered
+    pending = deque()
+    # (success, result or exception) in completion order, only filled if unordered
+    finished = queue.Queue()
+    n_pending = 0
+
+    while True:
+        while n_pending < max_pending:
+            item = next(items, _END)
+            if item is _END:
+                break
+            if ordered:
+                pending.append(pool.apply_async(fn, (item, )))
+            else:
+                pool.apply_async(
+                    fn, (item, ),
+                    callback=lambda res: finished.put((True, res)),
+                    error_callback=lambda exc: finished.put((False, exc)))
+            n_pending += 1
+        if n_pending == 0:
+            return
+
+        n_pending -= 1
+        if ordered:
+            yield pending.popleft().get()
+        else:
+            ok, res = finished.get()
+            if not ok:
+                raise res
+            yield res
+
+
+def _unpack_results(results, logger, sample_rate=1.0):
+    n_kept, n_seen = 0, 0
+    for result, chunk_kept, chunk_seen in results:
+        n_kept += chunk_kept
+        n_seen += chunk_seen
+        yield result
+    if sample_rate < 1:
+        _log_sample_size(logger, n_kept, n_seen)
+
+
+# A block gzip (BGZF-like) file is a series of independent gzip members, each holding
+# whole lines, so it's still a valid gzip file. Its sidecar index holds a row of the
+# compressed offset and the number of the first document for every block, plus a final
+# row of the file size and the number of documents.
+BGZF_SUFFIX = '.jsonl.bgz'
+BGZF_INDEX_SUFFIX = '.idx'
 
-def _read(corpus_dir, begin_year, end_year, encoding='utf-8'):
-    for year in range(begin_year, end_year + 1):
-        path = corpus_dir / f'{year}.jsonl'
-        if not path.exists():
-            path = corpus_dir / f'{year}.jsonl.gz'
-        open_fn = gzip.open if path.name.endswith('.gz') else open
 
-        with open_fn(path, 'rb') as f:
-            for line in f:
+def _get_path(corpus_dir, year):
+    # block gzip files can be split like uncompressed ones, so they're preferred over gzip
+    for suffix in ('.jsonl', BGZF_SUFFIX, '.jsonl.gz'):
+        path = corpus_dir / f'{year}{suffix}'
+        if path.exists():
+            return path
+    return path
+
+
+def _is_bgzf(path):
+    return path.name.endswith(BGZF_SUFFIX)
+
+
+def read_block_index(path):
+    with open(f'{path}{BGZF_INDEX_SUFFIX}', 'rb') as f:
+        return np.load(f)
+
+
+def _read_blocks(f, offsets):
+    for start, end in zip(offsets, offsets[1:]):
+        f.seek(start)
+        lines = gzip.decompress(f.read(end - start)).split(b'\n')
+        # the block ends with a newline
+        yield from lines[:-1]
+
+
+def _compress_block(data):
+    buf = io.BytesIO()
+    # mtime is fixed so the output is deterministic
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def write_bgzf(lines, path, block_bytes=256 * 2**10):
+    """Write lines to a block gzip file and its index."""
+    path = Path(path)
+    offsets, first_docs = [0], [0]
+    n_docs = 0
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        block = []
+        block_size = 0
+        for line in chain(lines, [None]):
+            if line is not None:
+                block.append(line if line.endswith(b'\n') else line + b'\n')
+                block_size += len(block[-1])
+                n_docs += 1
+            if block and (block_size >= block_bytes or line is None):
+                f.write(_compress_block(b''.join(block)))
+                offsets.append(f.tell())
+                first_docs.append(n_docs)
+                block, block_size = [], 0
+    with open(f'{path}{BGZF_INDEX_SUFFIX}', 'wb') as f:
+        np.save(f, np.array([offsets, first_docs], dtype=np.int64).T)
+    os.replace(tmp_path, path)
+
+
+@ing.command
+def convert_to_bgzf(_log, block_bytes=256 * 2**10):
+    """Convert the gzip corpus files to block gzip, so they can be split and seeked into."""
+    for _, _, path in list_files():
+        # uncompressed files can already be split
+        if not path.name.endswith('.gz'):
+            continue
+        bgzf_path = path.with_name(path.name[:-len('.jsonl.gz')] + BGZF_SUFFIX)
+        _log.info('Converting %s to %s', path, bgzf_path)
+        with gzip.open(path, 'rb') as f:
+            write_bgzf(f, bgzf_path, block_bytes=block_bytes)
+
+
+def read_doc(path, n, encoding='utf-8'):
+    """Read the n-th document (from 0) of a block gzip file, decompressing one block."""
+    index = read_block_index(path)
+    if not 0 <= n < index[-1, 1]:
+        raise IndexError(f'{path} has no document {n}')
+    k = np.searchsorted(index[:, 1], n, side='right') - 1
+    with open(path, 'rb') as f:
+        lines = _read_blocks(f, index[k:k + 2, 0])
+        line = next(islice(lines, int(n - index[k, 1]), None))
+    return json.loads(line.decode(encoding).strip())['paragraphs']
+
+
+def read_file(path, encoding='utf-8', sampler=None):
+    """Read the documents of a single corpus file, keeping those the sampler accepts."""
+    open_fn = gzip.open if path.name.endswith(('.gz', '.bgz')) else open
+
+    with open_fn(path, 'rb') as f:
+        for line in f:
+            if sampler is None or sampler(line):
                 yield json.loads(line.decode(encoding).strip())['paragraphs']
+
+
+def _read(corpus_dir, begin_year, end_year, encoding='utf-8', sampler=None):
+    for year in range(begin_year, end_year + 1):
+        yield from read_file(_get_path(corpus_dir, year), encoding=encoding, sampler=sampler)
+
+
+def _make_chunks(path, chunk_bytes):
+    if _is_bgzf(path):
+        # chunks start at the first block starting at or after multiples of chunk_bytes
+        offsets = read_block_index(path)[:, 0]
+        bounds = np.unique(np.append(
+            offsets[np.searchsorted(offsets, np.arange(0, offsets[-1], chunk_bytes))],
+            offsets[-1])).tolist()
+        return [(path, start, end) for start, end in zip(bounds, bounds[1:])]
+
+    # gzip files are a single stream that can't be seeked into, so they're read here and
+    # their lines are passed on in batches
+    if path.name.endswith('.gz'):
+        return _batch_lines(path, chunk_bytes)
+
+    size = path.stat().st_size
+    return [(path, start, min(start + chunk_bytes, size))
+            for start in range(0, max(size, 1), chunk_bytes)]
+
+
+def _batch_lines(path, chunk_bytes):
+    with gzip.open(path, 'rb') as f:
+        lines, size = [], 0
+        for line in f:
+            lines.append(line)
+            size += len(line)
+            if size >= chunk_bytes:
+                yield (path, None, lines)
+                lines, size = [], 0
+        if lines:
+            yield (path, None, lines)
+
+
+def _read_chunk(chunk, encoding='utf-8', sampler=None):
+    # A chunk is either a batch of lines (path, None, lines) or owns the lines starting
+    # within its byte range (path, start, end)
+    path, start, end = chunk
+    if start is None:
+        return [json.loads(line.decode(encoding).strip())['paragraphs']
+                for line in end if sampler is None or sampler(line)]
+
+    docs = []
+    if _is_bgzf(path):
+        offsets = read_block_index(path)[:, 0]
+        offsets = offsets[(offsets >= start) & (offsets <= end)]
+        with open(path, 'rb') as f:
+            for line in _read_blocks(f, offsets):
+                if sampler is None or sampler(line):
+                    docs.append(json.loads(line.decode(encoding).strip())['paragraphs'])
+        return docs
+
+    with open(path, 'rb') as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if sampler is None or sampler(line):
+                docs.append(json.loads(line.decode(encoding).strip())['paragraphs'])
+    return docs
+
+
+def _map_chunk(chunk, fn, encoding='utf-8', sample_rate=1.0, sample_seed=0):
+    sampler = DocSampler(sample_rate, sample_seed)
+    result = fn(_read_chunk(chunk, encoding=encoding, sampler=sampler))
+    return result, sampler.n_kept, sampler.n_seen
+
+
+def _identity(x):
+    return x
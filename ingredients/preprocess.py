@@ -14,6 +14,7 @@
 # limitations under the License.
 ##########################################################################
 
+from itertools import chain
 import re
 
 from sacred import Ingredient
@@ -31,20 +32,90 @@ def default():
     map_numbers = True
     # the special token to map numbers to
     number_token = '@@NUM@@'
+    # max number of distinct raw tokens to memoize (0 == no memoization)
+    cache_size = 2**20
+
+
+_MISSING = object()
+
+
+class SentPreprocessor:
+    """Preprocess sentences one token at a time, memoizing the result of each raw token.
+
+    A token is lowercased, dropped if it doesn't match the word pattern, and mapped to the
+    number token if it's a number. Since token types are Zipfian, most tokens are served
+    from the cache, which stops growing once it holds ``cache_size`` entries.
+    """
+
+    def __init__(
+            self,
+            lower=True,
+            word_pattern=r'[\w\-]+$',
+            map_numbers=True,
+            number_token='@@NUM@@',
+            cache_size=2**20):
+        self.lower = lower
+        self.word_re = re.compile(word_pattern)
+        self.number_re = re.compile(r'\d+$')
+        self.map_numbers = map_numbers
+        self.number_token = number_token
+        self.cache_size = cache_size
+        self.cache = {}
+        self.n_tokens = 0
+        self.n_misses = 0
+
+    def prep_word(self, word):
+        """Return the preprocessed word, or None if it should be removed."""
+        if self.lower:
+            word = word.lower()
+        if not self.word_re.match(word):
+            return None
+        if self.map_numbers and self.number_re.match(word):
+            return self.number_token
+        return word
+
+    def __call__(self, sent):
+        cache, get = self.cache, self.cache.get
+        res = []
+        for w in sent:
+            pw = get(w, _MISSING)
+            if pw is _MISSING:
+                self.n_misses += 1
+                pw = self.prep_word(w)
+                if len(cache) < self.cache_size:
+                    cache[w] = pw
+            if pw is not None:
+                res.append(pw)
+        self.n_tokens += len(sent)
+        return res
+
+    def prep_doc(self, paras):
+        """Preprocess all sentences of a document given as a list of paragraphs."""
+        return [self(sent) for sent in chain.from_iterable(paras)]
+
+    @property
+    def hit_rate(self):
+        return 1 - self.n_misses / self.n_tokens if self.n_tokens else 0.
+
+    def cache_info(self):
+        return {
+            'hits': self.n_tokens - self.n_misses,
+            'misses': self.n_misses,
+            'size': len(self.cache),
+            'maxsize': self.cache_size,
+        }
 
 
 @ing.capture
 def make_prep_sent(
-        lower=True, word_pattern=r'[\w\-]+$', map_numbers=True, number_token='@@NUM@@'):
-    word_re = re.compile(word_pattern)
-    number_re = re.compile(r'\d+$')
-
-    def prep_sent(sent):
-        if lower:
-            sent = [w.lower() for w in sent]
-        sent = [w for w in sent if word_re.match(w)]
-        if map_numbers:
-            sent = [number_token if number_re.match(w) else w for w in sent]
-        return sent
-
-    return prep_sent
+        lower=True,
+        word_pattern=r'[\w\-]+$',
+        map_numbers=True,
+        number_token='@@NUM@@',
+        cache_size=2**20):
+    return SentPreprocessor(
+        lower=lower,
+        word_pattern=word_pattern,
+        map_numbers=map_numbers,
+        number_token=number_token,
+        cache_size=cache_size)
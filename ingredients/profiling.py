@@ -0,0 +1,171 @@
+##########################################################################
+# Copyright 2019 Kata.ai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################
+
+from contextlib import contextmanager
+from pathlib import Path
+import cProfile
+import io
+import pstats
+import resource
+import tempfile
+import time
+import tracemalloc
+
+from sacred import Ingredient
+
+ing = Ingredient('profiling')
+
+
+@ing.config
+def default():
+    # whether to profile the run with cProfile (worker processes are not profiled)
+    cprofile = False
+    # whether to trace the peak memory allocated by Python with tracemalloc (slows the run
+    # down)
+    trace_memory = False
+    # number of functions and allocation sites to report
+    top_n = 30
+    # whether to log the wall time of named stages and the peak RSS as run scalars
+    timers = True
+    # directory to also save the profiles to (empty string == only attach them to the run)
+    save_dir = ''
+
+
+PROFILE_FNAME = 'profile.prof'
+PROFILE_REPORT_FNAME = 'profile.txt'
+TRACEMALLOC_REPORT_FNAME = 'tracemalloc.txt'
+
+# cProfile profiler of the current run
+_profiler = None
+
+
+@ing.pre_run_hook
+def start_profiling(_run, _log, cprofile=False, trace_memory=False):
+    global _profiler
+    if trace_memory:
+        _log.info('Tracing memory allocations')
+        tracemalloc.start()
+    if cprofile:
+        _log.info('Profiling the run')
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+def _write_profile(profiler, save_dir, top_n=30):
+    profiler.dump_stats(str(save_dir / PROFILE_FNAME))
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(top_n)
+    with open(save_dir / PROFILE_REPORT_FNAME, 'w') as f:
+        f.write(report.getvalue())
+    return [PROFILE_FNAME, PROFILE_REPORT_FNAME]
+
+
+def _write_tracemalloc(save_dir, top_n=30):
+    """Report the peak traced memory and the top allocation sites still alive."""
+    _, peak = tracemalloc.get_traced_memory()
+    stats = tracemalloc.take_snapshot().statistics('lineno')
+    tracemalloc.stop()
+    with open(save_dir / TRACEMALLOC_REPORT_FNAME, 'w') as f:
+        print(f'Peak traced memory: {peak / 2**20:.1f} MB', file=f)
+        print(f'Top {top_n} allocation sites at the end of the run:', file=f)
+        for stat in stats[:top_n]:
+            print(stat, file=f)
+    return peak, [TRACEMALLOC_REPORT_FNAME]
+
+
+@ing.post_run_hook
+def stop_profiling(
+        _log,
+        _run,
+        cprofile=False,
+        trace_memory=False,
+        top_n=30,
+        timers=True,
+        save_dir='',
+        failed=False):
+    """Attach the profiles to the run as artifacts, and their summaries as scalars.
+
+    Sacred doesn't run post-run hooks after a failure, so a failed stage calls this with
+    ``failed=True`` instead, which puts the summaries in the run info.
+    """
+    global _profiler
+    if _profiler is not None:
+        _profiler.disable()
+
+    if timers:
+        # ru_maxrss is in KB on Linux
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+        _record(_run, 'peak_rss_mb', peak_rss, failed)
+        _log.info('Peak RSS: %.1f MB', peak_rss)
+    if not cprofile and not trace_memory:
+        return
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        out_dir = Path(save_dir or tmpdir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        fnames = []
+        if _profiler is not None:
+            fnames.extend(_write_profile(_profiler, out_dir, top_n=top_n))
+            _profiler = None
+        if trace_memory and tracemalloc.is_tracing():
+            peak, tm_fnames = _write_tracemalloc(out_dir, top_n=top_n)
+            fnames.extend(tm_fnames)
+            _record(_run, 'traced_peak_mb', peak / 2**20, failed)
+            _log.info('Peak traced memory: %.1f MB', peak / 2**20)
+
+        for fname in fnames:
+            _run.add_artifact(str(out_dir / fname))
+        if save_dir:
+            _log.info('Saved profiles to %s', save_dir)
+
+
+def _record(run, name, value, failed=False):
+    if failed:
+        # the run info is saved along with the failure, unlike scalars logged that late
+        run.info.setdefault('profiling', {})[name] = value
+    else:
+        run.log_scalar(name, value)
+
+
+@ing.capture
+def _record_stage(name, wall_time, _log, _run, failed=False, timers=True):
+    if not timers:
+        return
+    _record(_run, f'{name}.wall_time', wall_time, failed)
+    if failed:
+        # the innermost stage, as the enclosing ones fail after it
+        _run.info.setdefault('profiling', {}).setdefault('failed_stage', name)
+        _log.info('Stage %s failed after %.1fs', name, wall_time)
+    else:
+        _log.info('Stage %s finished in %.1fs', name, wall_time)
+
+
+@contextmanager
+def stage(name):
+    """Time a named stage of the run, logging its wall time as the <name>.wall_time scalar.
+
+    If the stage fails, its wall time and the profiles so far are saved in the run info and
+    artifacts before the failure reaches Sacred.
+    """
+    start_time = time.time()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        _record_stage(name, time.time() - start_time, failed=failed)
+        if failed:
+            stop_profiling(failed=True)
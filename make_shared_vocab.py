@@ -16,12 +16,20 @@
 # limitations under the License.
 ##########################################################################
 
+from pathlib import Path
 import os
 
 from sacred import Experiment
 from sacred.observers import MongoObserver
+from tqdm import tqdm
+import numpy as np
 
-ex = Experiment(name='id-word2vec-make-shared-vocab')
+from ingredients.profiling import ing as profiling_ing
+from utils.vector_store import VectorStore, is_vector_store
+from utils.vocab_index import VocabIndex, intersect_vocabs, is_vocab_index, read_vocab
+from utils.word2vec_format import read_vectors, read_vectors_header
+
+ex = Experiment(name='id-word2vec-make-shared-vocab', ingredients=[profiling_ing])
 
 # Setup Mongo observer
 mongo_url = os.getenv('SACRED_MONGO_URL')
@@ -32,28 +40,103 @@ if mongo_url is not None and db_name is not None:
 
 @ex.config
 def default():
-    # comma-separated paths of vocab files
+    # comma-separated paths of vocab files, vectors files, or vocab index directories
     paths = 'vocab1.txt,vocab2.txt'
     # file encodings to use
     encodings = 'utf-8'
+    # whether the vectors files are in word2vec binary format
+    binary = False
+    # directory to save the shared vocab index to, along with a vector store of the shared
+    # vocab only for every vectors file or store, with rows in the same order as the index
+    # (empty string == print the shared vocab)
+    save_to = ''
+
+
+@ex.capture
+def get_vocab(path, _log, encoding='utf-8', binary=False):
+    _log.info('Reading vocabulary from %s', path)
+    return read_vocab(path, encoding=encoding, binary=binary)
 
 
 @ex.capture
-def get_vocab(path, _log, encoding='utf-8'):
-    with open(path, encoding=encoding) as f:
-        return {line.strip() for line in f}
+def get_shared_vectors(path, word2row, _log, encoding='utf-8', binary=False):
+    """Get the vectors of the shared words of a vectors file, in the given row order."""
+    found = np.zeros(len(word2row), dtype=bool)
+    if is_vector_store(path):
+        store = VectorStore.load(path)
+        rows = np.empty(len(word2row), dtype=np.int64)
+        for w, i in store.word2index.items():
+            row = word2row.get(w)
+            if row is not None:
+                rows[row] = i
+                found[row] = True
+        _check_found(path, found)
+        return store.vectors[rows]
+
+    _, dim = read_vectors_header(path)
+    vectors = np.empty((len(word2row), dim), dtype=np.float32)
+    for w, vec in tqdm(
+            read_vectors(path, binary=binary, encoding=encoding, words=word2row),
+            total=len(word2row)):
+        row = word2row[w]
+        # keep the first vector of a duplicated word
+        if not found[row]:
+            vectors[row] = vec
+            found[row] = True
+    _check_found(path, found)
+    return vectors
+
+
+def _check_found(path, found):
+    if not found.all():
+        raise ValueError(f'{path} lacks vectors of {(~found).sum()} shared words')
+
+
+def _has_vectors(path, binary=False):
+    if is_vocab_index(path):
+        return False
+    if binary or is_vector_store(path):
+        return True
+    try:
+        read_vectors_header(path)
+    except ValueError:
+        # a vocab file
+        return False
+    return True
+
+
+def _get_name(path):
+    # e.g. vectors for vectors.txt, vectors.txt.gz, or vectors.store
+    name = Path(path.rstrip(os.sep)).name
+    if name.endswith('.gz'):
+        name = name[:-len('.gz')]
+    return Path(name).stem
 
 
 @ex.automain
-def make_shared(paths, encodings):
-    """Make a shared vocab from the vocab files."""
-    shared_vocab = None
-    for path in paths.split(','):
-        vocab = get_vocab(path)
-        if shared_vocab is None:
-            shared_vocab = vocab
-        else:
-            shared_vocab.intersection_update(vocab)
-
-    for w in sorted(shared_vocab):
-        print(w)
+def make_shared(paths, _log, encodings, binary=False, save_to=''):
+    """Make a shared vocab from the vocab files, optionally saving aligned vectors."""
+    paths = paths.split(',')
+    shared_vocab = intersect_vocabs([get_vocab(path) for path in paths])
+
+    if not save_to:
+        for w in sorted(shared_vocab):
+            print(w)
+        return
+
+    save_to = Path(save_to)
+    # vocab files and indexes only count towards the shared vocab
+    paths = [path for path in paths if _has_vectors(path, binary=binary)]
+    names = [_get_name(path) for path in paths]
+    if len(set(names)) != len(names):
+        raise ValueError('vectors files must have distinct names')
+
+    index = VocabIndex.build(shared_vocab)
+    _log.info('Saving shared vocab index of %d words to %s', len(index), save_to)
+    index.save(save_to / 'vocab.index')
+    words = list(index)
+    word2row = {w: i for i, w in enumerate(words)}
+    for path, name in zip(paths, names):
+        store_path = save_to / f'{name}.store'
+        _log.info('Saving shared vectors of %s to %s', path, store_path)
+        VectorStore(words, get_shared_vectors(path, word2row)).save(store_path)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+##########################################################################
+# Copyright 2019 Kata.ai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################
+
+import os
+
+from sacred import Experiment
+from sacred.observers import MongoObserver
+
+from ingredients.corpus import ing as corpus_ing, get_year_ranges
+from ingredients.profiling import ing as profiling_ing
+from utils.synthetic import write_dataset
+
+ex = Experiment(name='id-word2vec-make-synthetic-data', ingredients=[corpus_ing, profiling_ing])
+
+# Setup Mongo observer
+mongo_url = os.getenv('SACRED_MONGO_URL')
+db_name = os.getenv('SACRED_DB_NAME')
+if mongo_url is not None and db_name is not None:
+    ex.observers.append(MongoObserver.create(url=mongo_url, db_name=db_name))
+
+
+@ex.config
+def default():
+    # directory to save the synthetic data to
+    save_to = 'synthetic'
+    # total number of documents in the corpus
+    n_docs = 10000
+    # number of distinct words the corpus is drawn from
+    vocab_size = 50000
+    # exponent of the Zipf distribution of word frequencies
+    zipf_exponent = 1.0
+    # whether to gzip the corpus files
+    compress = False
+    # number of word vectors
+    vectors_vocab_size = 20000
+    # dimension of the word vectors
+    dim = 100
+    # number of analogies
+    n_analogies = 1000
+    # how far the answer of an analogy is from the analogy's query vector
+    noise = 2.0
+
+
+@ex.automain
+def make_data(
+        save_to,
+        _log,
+        seed,
+        n_docs=10000,
+        vocab_size=50000,
+        zipf_exponent=1.0,
+        compress=False,
+        vectors_vocab_size=20000,
+        dim=100,
+        n_analogies=1000,
+        noise=2.0):
+    """Generate a synthetic corpus, word vectors, and analogies.
+
+    The corpus years follow the corpus ingredient config, so the corpus can be read with
+    ``corpus.path=<save_to>/corpus``.
+    """
+    years = [(product, begin, end) for product, _, begin, end in get_year_ranges(path='')]
+    _log.info('Writing synthetic data to %s', save_to)
+    write_dataset(
+        save_to,
+        years,
+        n_docs=n_docs,
+        vocab_size=vocab_size,
+        exponent=zipf_exponent,
+        compress=compress,
+        vectors_vocab_size=vectors_vocab_size,
+        dim=dim,
+        n_analogies=n_analogies,
+        noise=noise,
+        seed=seed)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+##########################################################################
+# Copyright 2019 Kata.ai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################
+
+import os
+
+from gensim.models import KeyedVectors
+from sacred import Experiment
+from sacred.observers import MongoObserver
+
+from ingredients.profiling import ing as profiling_ing
+from utils.vector_store import VectorStore
+
+ex = Experiment(name='id-word2vec-make-vector-store', ingredients=[profiling_ing])
+
+# Setup Mongo observer
+mongo_url = os.getenv('SACRED_MONGO_URL')
+db_name = os.getenv('SACRED_DB_NAME')
+if mongo_url is not None and db_name is not None:
+    ex.observers.append(MongoObserver.create(url=mongo_url, db_name=db_name))
+
+
+@ex.config
+def default():
+    # path to vectors file in word2vec format
+    path = 'vectors.txt'
+    # whether the vectors file is in word2vec binary format
+    binary = False
+    # file encoding to use
+    encoding = 'utf-8'
+    # directory to save the vector store to
+    save_to = 'vectors.store'
+
+
+@ex.automain
+def convert(path, _log, binary=False, encoding='utf-8', save_to='vectors.store'):
+    """Convert a word2vec format vectors file into a memory-mapped vector store."""
+    _log.info('Loading word vectors from %s', path)
+    kv = KeyedVectors.load_word2vec_format(path, binary=binary, encoding=encoding)
+    _log.info('Saving vector store to %s', save_to)
+    VectorStore(kv.index2word, kv.vectors).save(save_to)
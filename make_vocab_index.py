@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+##########################################################################
+# Copyright 2019 Kata.ai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################
+
+import os
+
+from sacred import Experiment
+from sacred.observers import MongoObserver
+
+from ingredients.profiling import ing as profiling_ing
+from utils.vocab_index import VocabIndex, read_words
+
+ex = Experiment(name='id-word2vec-make-vocab-index', ingredients=[profiling_ing])
+
+# Setup Mongo observer
+mongo_url = os.getenv('SACRED_MONGO_URL')
+db_name = os.getenv('SACRED_DB_NAME')
+if mongo_url is not None and db_name is not None:
+    ex.observers.append(MongoObserver.create(url=mongo_url, db_name=db_name))
+
+
+@ex.config
+def default():
+    # path to vectors file in word2vec text format (can be gzipped), vector store
+    # directory, or vocab file with one word in each line
+    path = 'vectors.txt'
+    # file encoding to use
+    encoding = 'utf-8'
+    # directory to save the vocab index to
+    save_to = 'vocab.index'
+
+
+@ex.automain
+def make_index(path, _log, encoding='utf-8', save_to='vocab.index'):
+    """Build a memory-mapped vocab index from a vectors or vocab file."""
+    _log.info('Reading words from %s', path)
+    index = VocabIndex.build(read_words(path, encoding=encoding))
+    _log.info('Saving vocab index of %d words to %s', len(index), save_to)
+    index.save(save_to)
@@ -18,11 +18,16 @@
 
 import os
 import pickle
+import sys
 
 from sacred import Experiment
 from sacred.observers import MongoObserver
 
-ex = Experiment(name='id-word2vec-polyglot2vec')
+from ingredients.profiling import ing as profiling_ing
+from utils.vector_store import VectorStore
+from utils.word2vec_format import write_binary, write_text
+
+ex = Experiment(name='id-word2vec-polyglot2vec', ingredients=[profiling_ing])
 
 # Setup Mongo observer
 mongo_url = os.getenv('SACRED_MONGO_URL')
@@ -37,10 +42,17 @@ def default():
     path = ''
     # string encoding to use
     encoding = 'latin1'
+    # save format (text or binary for word2vec format, or store for a memory-mapped vector
+    # store directory)
+    save_format = 'text'
+    # where to save the result (empty string == print to stdout, text format only)
+    save_to = ''
+    # number of significant digits of the vector values in text format
+    precision = 6
 
 
 @ex.automain
-def convert(path, encoding='latin1'):
+def convert(path, _log, encoding='latin1', save_format='text', save_to='', precision=6):
     """Convert Polyglot's word vectors into word2vec format."""
     with open(path, 'rb') as f:
         tokens, vectors = pickle.load(f, encoding=encoding)
@@ -48,6 +60,21 @@ def convert(path, encoding='latin1'):
     if len(tokens) != vectors.shape[0]:
         raise ValueError('length of vectors and tokens mismatch')
 
-    print(vectors.shape[0], vectors.shape[1])
-    for tok, vec in zip(tokens, vectors):
-        print(tok, ' '.join(str(v) for v in vec))
+    if save_format == 'text':
+        if not save_to:
+            write_text(sys.stdout, tokens, vectors, precision=precision)
+            return
+        with open(save_to, 'w', encoding='utf-8', buffering=2**20) as f:
+            write_text(f, tokens, vectors, precision=precision)
+    elif save_format == 'binary':
+        if not save_to:
+            raise ValueError('save_to must be set for binary format')
+        with open(save_to, 'wb', buffering=2**20) as f:
+            write_binary(f, tokens, vectors)
+    elif save_format == 'store':
+        if not save_to:
+            raise ValueError('save_to must be set for store format')
+        VectorStore(list(tokens), vectors).save(save_to)
+    else:
+        raise ValueError(f'unknown save format: {save_format}')
+    _log.info('Saved %d word vectors to %s', len(tokens), save_to)
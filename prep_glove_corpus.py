@@ -16,17 +16,24 @@
 # limitations under the License.
 ##########################################################################
 
-from itertools import chain
+from contextlib import ExitStack
+import gzip
 import os
+import sys
+import time
 
 from sacred import Experiment
 from sacred.observers import MongoObserver
 from tqdm import tqdm
 
-from ingredients.corpus import ing as corpus_ing, read_corpus
-from ingredients.preprocess import ing as prep_ing, make_prep_sent
+from ingredients.cache import ing as cache_ing, iter_lines
+from ingredients.corpus import ing as corpus_ing
+from ingredients.preprocess import ing as prep_ing
+from ingredients.profiling import ing as profiling_ing
 
-ex = Experiment(name='id-word2vec-prep-glove-corpus', ingredients=[corpus_ing, prep_ing])
+ex = Experiment(
+    name='id-word2vec-prep-glove-corpus',
+    ingredients=[corpus_ing, prep_ing, cache_ing, profiling_ing])
 
 # Setup Mongo observer
 mongo_url = os.getenv('SACRED_MONGO_URL')
@@ -35,12 +42,74 @@ if mongo_url is not None and db_name is not None:
     ex.observers.append(MongoObserver.create(url=mongo_url, db_name=db_name))
 
 
+@ex.config
+def default():
+    # where to write the corpus (empty string == stdout)
+    output = ''
+    # number of shard files to split the corpus into, named {output}.{shard:03d}
+    num_shards = 1
+    # compression of the output files (none, gzip, or zstd)
+    compression = 'none'
+    # number of documents written to the same shard before moving to the next one
+    shard_docs = 10000
+
+
+def open_output(path, compression='none'):
+    if compression == 'none':
+        return open(path, 'w', encoding='utf-8', buffering=2**20)
+    if compression == 'gzip':
+        return gzip.open(path, 'wt', encoding='utf-8')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('zstd compression requires the zstandard package (>=0.15)')
+        if not hasattr(zstandard, 'open'):
+            raise ImportError(
+                f'zstd compression requires zstandard>=0.15, found {zstandard.__version__}')
+        return zstandard.open(path, 'wt', encoding='utf-8')
+    raise ValueError(f'unknown compression: {compression}')
+
+
 @ex.automain
-def prepare():
+def prepare(
+        _log,
+        _run,
+        output='',
+        num_shards=1,
+        compression='none',
+        shard_docs=10000):
     """Prepare corpus for training with GloVe."""
-    prep_sent = make_prep_sent()
-    for paras in tqdm(read_corpus(), unit='doc'):
-        sents = []
-        for sent in chain.from_iterable(paras):
-            sents.append(' '.join(prep_sent(sent)))
-        print(' '.join(sents))
+    lines = iter_lines()
+
+    with ExitStack() as stack:
+        if not output:
+            if num_shards != 1 or compression != 'none':
+                raise ValueError('sharding and compression need an output file')
+            outfiles = [sys.stdout]
+        elif num_shards == 1:
+            outfiles = [stack.enter_context(open_output(output, compression))]
+        else:
+            outfiles = [
+                stack.enter_context(open_output(f'{output}.{k:03d}', compression))
+                for k in range(num_shards)
+            ]
+
+        start_time = time.time()
+        num_docs, num_bytes = 0, 0
+        for line in tqdm(lines, unit='doc'):
+            # documents are assigned to shards in fixed-size runs, so the output is
+            # deterministic regardless of the number of workers
+            outfile = outfiles[(num_docs // shard_docs) % len(outfiles)]
+            print(line, file=outfile)
+            num_docs += 1
+            num_bytes += len(line.encode('utf-8')) + 1
+        elapsed = time.time() - start_time
+
+    docs_per_sec = num_docs / elapsed if elapsed else 0.
+    mb_per_sec = num_bytes / 2**20 / elapsed if elapsed else 0.
+    _run.log_scalar('docs_per_sec', docs_per_sec)
+    _run.log_scalar('mb_per_sec', mb_per_sec)
+    _log.info(
+        'Wrote %d documents (%.1f MB) at %.1f docs/sec, %.2f MB/sec', num_docs,
+        num_bytes / 2**20, docs_per_sec, mb_per_sec)
@@ -21,7 +21,10 @@ import os
 from sacred import Experiment
 from sacred.observers import MongoObserver
 
-ex = Experiment(name='id-word2vec-print-analogy-vocab')
+from ingredients.profiling import ing as profiling_ing
+from utils.vocab_index import read_vocab
+
+ex = Experiment(name='id-word2vec-print-analogy-vocab', ingredients=[profiling_ing])
 
 # Setup Mongo observer
 mongo_url = os.getenv('SACRED_MONGO_URL')
@@ -38,6 +41,9 @@ def default():
     encoding = 'utf-8'
     # whether to lowercase words
     lower = True
+    # only print words in this vocab file, vectors file, or vocab index directory (empty
+    # string == print all words)
+    vocab_path = ''
 
 
 @ex.capture
@@ -54,7 +60,7 @@ def get_vocab_from_line(line, lower=True):
 
 
 @ex.automain
-def print_vocab(path, encoding='utf-8'):
+def print_vocab(path, _log, encoding='utf-8', vocab_path=''):
     """Print vocabulary of the given analogy file."""
     vocab = set()
     with open(path, encoding=encoding) as f:
@@ -63,5 +69,10 @@ def print_vocab(path, encoding='utf-8'):
                 continue  # skip section title
             vocab.update(get_vocab_from_line(line.strip()))
 
+    if vocab_path:
+        _log.info('Reading vocabulary from %s', vocab_path)
+        other_vocab = read_vocab(vocab_path, encoding=encoding)
+        vocab = {w for w in vocab if w in other_vocab}
+
     for w in sorted(vocab):
         print(w)
@@ -16,30 +16,229 @@
 # limitations under the License.
 ##########################################################################
 
-from itertools import chain
+from collections import Counter
+from functools import partial
+from multiprocessing import Pool
+import os
 
 from sacred import Experiment
 from tqdm import tqdm
+import numpy as np
 
-from ingredients.corpus import ing as corpus_ing, read_corpus
+from ingredients.cache import ing as cache_ing, get_cache_dir, open_cache
+from ingredients.corpus import DocSampler, ing as corpus_ing, list_files, read_file
 from ingredients.preprocess import ing as prep_ing, make_prep_sent
+from ingredients.profiling import ing as profiling_ing
+from utils.sketches import HASH_CACHE_SIZE, FrequencySketch, hash_cache_nbytes
+from utils.word_freqs import write_word_freqs
 
-ex = Experiment(ingredients=[corpus_ing, prep_ing])
+ex = Experiment(ingredients=[corpus_ing, prep_ing, cache_ing, profiling_ing])
 
 
-@ex.automain
-def print_stats():
-    prep_sent = make_prep_sent()
+@ex.config
+def default():
+    # number of worker processes, each counting one corpus file at a time
+    workers = os.cpu_count()
+    # print the number of word types occurring at least this many times
+    min_counts = [1, 5, 10, 50]
+    # whether to compute approximate statistics with bounded memory
+    approximate = False
+    # write the exact word frequencies to this file, which run_word2vec.py can build its
+    # vocabulary from (empty string == don't write, not supported in approximate mode)
+    save_freqs_to = ''
+    # configuration of the sketches used in approximate mode
+    sketch = {
+        # HyperLogLog precision for counting word types (uses 2**precision bytes)
+        'hll_precision': 14,
+        # count-min sketch width and depth (uses 8 * width * depth bytes, i.e. 32 MB by
+        # default; every worker holds a sketch and merging holds up to three more)
+        'cms_width': 2**20,
+        'cms_depth': 4,
+        # number of most frequent words to print
+        'top_n': 20,
+        # number of word types to keep exact counts of, for estimating min_count survivors
+        # (about 200 bytes each, i.e. 13 MB by default)
+        'sample_size': 2**16,
+    }
+
+
+def get_sampler(config):
+    # the printed counts are those of the sampled documents
+    return DocSampler(config['corpus']['sample_rate'], config['corpus']['sample_seed'])
+
+
+def count_file(path, prep_sent, encoding='utf-8', sampler=None):
+    num_articles, num_tokens = 0, 0
+    counts = Counter()
+
+    for paras in read_file(path, encoding=encoding, sampler=sampler):
+        num_articles += 1
+        for sent in prep_sent.prep_doc(paras):
+            num_tokens += len(sent)
+            counts.update(sent)
+
+    return num_articles, num_tokens, counts
+
+
+def sketch_file(path, prep_sent, sketch_config, encoding='utf-8', sampler=None):
     num_articles, num_tokens = 0, 0
-    vocab = set()
+    sketch = FrequencySketch(**sketch_config)
 
-    for paras in tqdm(read_corpus(), unit='doc'):
+    for paras in read_file(path, encoding=encoding, sampler=sampler):
         num_articles += 1
-        for sent in chain.from_iterable(paras):
-            sent = prep_sent(sent)
+        counts = Counter()
+        for sent in prep_sent.prep_doc(paras):
             num_tokens += len(sent)
-            vocab.update(sent)
+            counts.update(sent)
+        sketch.update(counts)
+
+    return num_articles, num_tokens, sketch
+
+
+def count_cache(cache_dir):
+    vocab, tokens, _, doc_offsets = open_cache(cache_dir)
+    return len(doc_offsets) - 1, len(tokens), vocab, np.bincount(tokens, minlength=len(vocab))
+
+
+def print_threshold_table(freqs, min_counts):
+    freqs = np.sort(freqs)
+    cum_tokens = np.concatenate([[0], np.cumsum(freqs)])
+    print(f'{"min_count":>9}  {"# word types":>12}  {"# word tokens":>13}')
+    for min_count in min_counts:
+        k = np.searchsorted(freqs, min_count)
+        print(f'{min_count:>9}  {len(freqs) - k:>12}  {cum_tokens[-1] - cum_tokens[k]:>13}')
+
+
+def print_approx_stats(files, results, min_counts):
+    # results are merged as they come so only a few sketches are in memory at any time
+    rows = []
+    total_articles, total_tokens, total_sketch = 0, 0, None
+    prod_articles, prod_tokens, prod_sketch = 0, 0, None
+    for k, ((product, year, _), (num_articles, num_tokens, sketch)) in enumerate(
+            zip(files, results)):
+        rows.append((product, year, num_articles, num_tokens, sketch.hll.estimate()))
+        prod_articles += num_articles
+        prod_tokens += num_tokens
+        if prod_sketch is None:
+            prod_sketch = sketch
+        else:
+            prod_sketch.merge(sketch)
+
+        if k + 1 == len(files) or files[k + 1][0] != product:
+            num_types = prod_sketch.hll.estimate()
+            rows.append((product, 'all', prod_articles, prod_tokens, num_types))
+            total_articles += prod_articles
+            total_tokens += prod_tokens
+            if total_sketch is None:
+                total_sketch = prod_sketch
+            else:
+                total_sketch.merge(prod_sketch)
+            prod_articles, prod_tokens, prod_sketch = 0, 0, None
+
+    hll_err = total_sketch.hll.relative_error
+    print('# articles    :', total_articles)
+    print('# word tokens :', total_tokens)
+    print(f'# word types  : {total_sketch.hll.estimate():.0f} (±{hll_err:.2%} std. error)')
+    print()
+    print(f'{"product":<7}  {"year":>4}  {"# articles":>10}  {"# word tokens":>13}  '
+          f'{"# word types":>12}')
+    for row in rows:
+        print('{:<7}  {:>4}  {:>10}  {:>13}  {:>12.0f}'.format(*row))
+    print(f'(word types have ±{hll_err:.2%} std. error)')
+    print()
+    print(f'{"min_count":>9}  {"# word types":>12}  {"std. error":>10}')
+    for min_count in min_counts:
+        est, std_err = total_sketch.sample.estimate_at_least(min_count)
+        print(f'{min_count:>9}  {est:>12.0f}  {std_err:>10.0f}')
+    print()
+    cms = total_sketch.cms
+    print(f'{"word":<20}  {"frequency":>13}')
+    for word, freq in cms.top():
+        print(f'{word:<20}  {freq:>13}')
+    print(
+        f'(frequencies overestimate by at most {cms.error_bound:.0f} '
+        f'with probability {cms.confidence:.2%})')
+
+
+@ex.automain
+def print_stats(
+        _log,
+        _config,
+        workers=1,
+        min_counts=(1, 5, 10, 50),
+        approximate=False,
+        save_freqs_to='',
+        sketch=None):
+    if approximate:
+        if save_freqs_to:
+            raise ValueError('cannot save exact word frequencies in approximate mode')
+        files = list_files()
+        sketch_fn = partial(
+            sketch_file,
+            prep_sent=make_prep_sent(),
+            sketch_config=sketch,
+            encoding=_config['corpus']['encoding'],
+            sampler=get_sampler(_config))
+        sketch_mb = FrequencySketch(**sketch).nbytes / 2**20
+        _log.info(
+            'Each sketch takes up to %.1f MB including its sampled words, and each worker '
+            'also caches up to %d word hashes (%.1f MB)',
+            sketch_mb, HASH_CACHE_SIZE, hash_cache_nbytes() / 2**20)
+        with Pool(workers) as pool:
+            results = pool.imap(sketch_fn, [path for _, _, path in files])
+            print_approx_stats(files, tqdm(results, total=len(files)), min_counts)
+        return
+
+    if _config['cache']['enabled']:
+        _log.info('Counting from corpus cache, so there is no per-year breakdown')
+        num_articles, num_tokens, vocab, freqs = count_cache(get_cache_dir())
+        if save_freqs_to:
+            _log.info('Writing word frequencies to %s', save_freqs_to)
+            write_word_freqs({w: int(c) for w, c in zip(vocab, freqs) if c > 0}, save_freqs_to)
+        freqs = freqs[freqs > 0]
+        print('# articles    :', num_articles)
+        print('# word tokens :', num_tokens)
+        print('# word types  :', len(freqs))
+        print()
+        print_threshold_table(freqs, min_counts)
+        return
+
+    files = list_files()
+    count_fn = partial(
+        count_file,
+        prep_sent=make_prep_sent(),
+        encoding=_config['corpus']['encoding'],
+        sampler=get_sampler(_config))
+    with Pool(workers) as pool:
+        results = list(
+            tqdm(pool.imap(count_fn, [path for _, _, path in files]), total=len(files)))
+
+    rows = []
+    total_articles, total_tokens, total_counts = 0, 0, Counter()
+    for product in sorted(set(product for product, _, _ in files)):
+        prod_articles, prod_tokens, prod_counts = 0, 0, Counter()
+        for (prod, year, _), (num_articles, num_tokens, counts) in zip(files, results):
+            if prod == product:
+                rows.append((product, year, num_articles, num_tokens, len(counts)))
+                prod_articles += num_articles
+                prod_tokens += num_tokens
+                prod_counts.update(counts)
+        rows.append((product, 'all', prod_articles, prod_tokens, len(prod_counts)))
+        total_articles += prod_articles
+        total_tokens += prod_tokens
+        total_counts.update(prod_counts)
+
+    if save_freqs_to:
+        _log.info('Writing word frequencies to %s', save_freqs_to)
+        write_word_freqs(total_counts, save_freqs_to)
 
-    print('# articles    :', num_articles)
-    print('# word tokens :', num_tokens)
-    print('# word types  :', len(vocab))
+    print('# articles    :', total_articles)
+    print('# word tokens :', total_tokens)
+    print('# word types  :', len(total_counts))
+    print()
+    print(f'{"product":<7}  {"year":>4}  {"# articles":>10}  {"# word tokens":>13}  '
+          f'{"# word types":>12}')
+    for row in rows:
+        print('{:<7}  {:>4}  {:>10}  {:>13}  {:>12}'.format(*row))
+    print()
+    print_threshold_table(np.array(list(total_counts.values()), dtype=np.int64), min_counts)
@@ -16,14 +16,19 @@
 # limitations under the License.
 ##########################################################################
 
-import gzip
+from functools import partial
+from multiprocessing import Pool
 import os
 
 from sacred import Experiment
 from sacred.observers import MongoObserver
 from tqdm import tqdm
 
-ex = Experiment(name='id-word2vec-print-vectors-vocab')
+from ingredients.profiling import ing as profiling_ing
+from utils.vocab_index import VocabIndex, is_vocab_index
+from utils.word2vec_format import read_header, read_text_words, read_vectors_words
+
+ex = Experiment(name='id-word2vec-print-vectors-vocab', ingredients=[profiling_ing])
 
 # Setup Mongo observer
 mongo_url = os.getenv('SACRED_MONGO_URL')
@@ -34,33 +39,46 @@ if mongo_url is not None and db_name is not None:
 
 @ex.config
 def default():
-    # path to vectors file in word2vec format (can be gzipped)
+    # path to vectors file in word2vec format (can be gzipped), or vocab index directory
     path = 'vectors.txt'
     # file encoding to use
     encoding = 'utf-8'
+    # whether the vectors file is in word2vec binary format
+    binary = False
+    # number of worker processes to read uncompressed text files with
+    workers = os.cpu_count()
+    # split uncompressed text files into byte ranges of this size for the workers
+    chunk_bytes = 64 * 2**20
+
+
+def _read_range(byte_range, path, dim, encoding='utf-8'):
+    return read_text_words(path, dim, *byte_range, encoding=encoding)
 
 
 @ex.automain
-def print_vocab(path, encoding='utf-8'):
+def print_vocab(
+        path, _log, encoding='utf-8', binary=False, workers=1, chunk_bytes=64 * 2**20):
     """Print vocabulary of the given vectors file."""
-    vocab = set()
-    open_fn = gzip.open if path.endswith('.gz') else open
+    if is_vocab_index(path):
+        for w in sorted(VocabIndex.load(path)):
+            print(w)
+        return
 
-    with open_fn(path, 'rb') as f:
-        header = next(f).decode(encoding)
-        total = int(header.split()[0])
-        for line in tqdm(f, total=total):
-            line = line.decode(encoding)
-            ents = line.split()
-            k = 0
-            while k < len(ents):
-                try:
-                    float(ents[k])
-                except ValueError:
-                    k += 1
-                else:
-                    break
-            vocab.add(' '.join(ents[:k]))
+    vocab = set()
+    if binary or path.endswith('.gz') or workers <= 1:
+        vocab.update(tqdm(read_vectors_words(path, binary=binary, encoding=encoding)))
+    else:
+        with open(path, 'rb') as f:
+            _, dim = read_header(f)
+            header_end = f.tell()
+        size = os.path.getsize(path)
+        ranges = [(start, min(start + chunk_bytes, size))
+                  for start in range(header_end, size, chunk_bytes)]
+        _log.info('Reading %d byte ranges with %d workers', len(ranges), workers)
+        read_fn = partial(_read_range, path=path, dim=dim, encoding=encoding)
+        with Pool(workers) as pool:
+            for words in tqdm(pool.imap_unordered(read_fn, ranges), total=len(ranges)):
+                vocab.update(words)
 
     for w in sorted(vocab):
         print(w)
@@ -21,7 +21,10 @@ import os
 from sacred import Experiment
 from sacred.observers import MongoObserver
 
-ex = Experiment(name='id-word2vec-remove-oov-analogy')
+from ingredients.profiling import ing as profiling_ing
+from utils.vocab_index import read_vocab as read_vocab_file
+
+ex = Experiment(name='id-word2vec-remove-oov-analogy', ingredients=[profiling_ing])
 
 # Setup Mongo observer
 mongo_url = os.getenv('SACRED_MONGO_URL')
@@ -34,7 +37,7 @@ if mongo_url is not None and db_name is not None:
 def default():
     # path to analogy task file
     analogy_path = 'analogy.txt'
-    # path to vocab file, one word in each line
+    # path to vocab file (one word in each line), vectors file, or vocab index directory
     vocab_path = 'vocab.txt'
     # file encoding to use
     encoding = 'utf-8'
@@ -45,8 +48,7 @@ def default():
 @ex.capture
 def read_vocab(vocab_path, _log, encoding='utf-8'):
     _log.info('Reading vocabulary from %s', vocab_path)
-    with open(vocab_path, encoding=encoding) as f:
-        return {line.strip() for line in f}
+    return read_vocab_file(vocab_path, encoding=encoding)
 
 
 @ex.automain
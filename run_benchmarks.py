@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+
+##########################################################################
+# Copyright 2019 Kata.ai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################
+
+from datetime import datetime
+from pathlib import Path
+import gc
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+
+from sacred import Experiment
+from sacred.observers import MongoObserver
+
+from ingredients.corpus import ing as corpus_ing, _read, get_year_ranges
+from ingredients.preprocess import ing as prep_ing, make_prep_sent
+from run_evaluation import ex as eval_ex, compute_bootstrap_ci, get_corrects, \
+    load_word_vectors
+from run_word2vec import SentencesCorpus
+from utils.synthetic import ANALOGY_FNAME, CORPUS_DIRNAME, STORE_DIRNAME, VECTORS_FNAME, \
+    write_dataset
+from utils.vector_store import VectorStore
+
+ex = Experiment(name='id-word2vec-benchmarks', ingredients=[corpus_ing, prep_ing])
+
+# Setup Mongo observer
+mongo_url = os.getenv('SACRED_MONGO_URL')
+db_name = os.getenv('SACRED_DB_NAME')
+if mongo_url is not None and db_name is not None:
+    ex.observers.append(MongoObserver.create(url=mongo_url, db_name=db_name))
+
+
+@ex.config
+def default():
+    # directory to generate the synthetic data of every scale in
+    data_dir = 'benchmarks'
+    # scales to benchmark at, each multiplying the number of documents, word vectors, and
+    # analogies below
+    scales = [1, 10]
+    # number of corpus documents at scale 1
+    n_docs = 1000
+    # number of distinct words the corpus is drawn from
+    vocab_size = 50000
+    # number of word vectors at scale 1
+    vectors_vocab_size = 10000
+    # dimension of the word vectors
+    dim = 100
+    # number of analogies at scale 1
+    n_analogies = 500
+    # seed of the synthetic data, fixed so the data is only generated once
+    data_seed = 0
+    # number of timed repetitions of each hot path (the fastest one is reported)
+    repeat = 3
+    # whether to measure the peak memory of each hot path with tracemalloc (in an extra
+    # repetition, since tracing slows Python code down)
+    trace_memory = True
+    # names of the hot paths to benchmark (empty == all)
+    only = []
+    # path to save the results to as JSON
+    save_to = 'benchmarks.json'
+    # results (of another commit) to compare against with the compare command
+    base_path = 'benchmarks.base.json'
+
+
+# name -> (setup, unit, experiment); setup takes the data directory and returns a function
+# that runs the hot path once and returns how many units it processed. Hot paths of another
+# experiment are run within a run of that experiment, so its captured functions are
+# configured.
+HOT_PATHS = {}
+
+
+def hot_path(name, unit, experiment=None):
+    def decorator(setup):
+        HOT_PATHS[name] = (setup, unit, experiment)
+        return setup
+    return decorator
+
+
+def _read_docs(path):
+    for _, corpus_dir, begin, end in get_year_ranges(path=path / CORPUS_DIRNAME):
+        yield from _read(corpus_dir, begin, end)
+
+
+@hot_path('corpus._read', 'docs')
+def _setup_read(path):
+    return lambda: sum(1 for _ in _read_docs(path))
+
+
+@hot_path('prep.make_prep_sent', 'tokens')
+def _setup_prep(path):
+    docs = list(_read_docs(path))
+
+    def run():
+        prep_sent = make_prep_sent()
+        for paras in docs:
+            prep_sent.prep_doc(paras)
+        return prep_sent.n_tokens
+
+    return run
+
+
+@hot_path('word2vec.SentencesCorpus', 'sents')
+def _setup_sentences(path):
+    def read_prep_corpus():
+        prep_sent = make_prep_sent()
+        return (prep_sent.prep_doc(paras) for paras in _read_docs(path))
+
+    return lambda: sum(1 for _ in SentencesCorpus(read_prep_corpus))
+
+
+@hot_path('eval.load_word_vectors(text)', 'words', experiment=eval_ex)
+def _setup_load_text(path):
+    return lambda: len(load_word_vectors(vectors_path=str(path / VECTORS_FNAME)))
+
+
+@hot_path('eval.load_word_vectors(store)', 'words', experiment=eval_ex)
+def _setup_load_store(path):
+    return lambda: len(load_word_vectors(vectors_path=str(path / STORE_DIRNAME)))
+
+
+def _get_corrects(path):
+    store = VectorStore.load(path / STORE_DIRNAME)
+    with open(path / ANALOGY_FNAME, encoding='utf-8') as f:
+        return get_corrects(store, f)
+
+
+@hot_path('eval.get_corrects', 'analogies', experiment=eval_ex)
+def _setup_corrects(path):
+    return lambda: sum(len(cs) for cs in _get_corrects(path).values())
+
+
+@hot_path('eval.compute_bootstrap_ci', 'analogies', experiment=eval_ex)
+def _setup_bootstrap(path):
+    samples = [c for cs in _get_corrects(path).values() for c in cs]
+
+    def run():
+        compute_bootstrap_ci(samples)
+        return len(samples)
+
+    return run
+
+
+def measure(run, repeat=3, trace_memory=True):
+    """Time the given function, and optionally trace its peak memory in one more call."""
+    seconds = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start_time = time.perf_counter()
+        n = run()
+        seconds = min(seconds, time.perf_counter() - start_time)
+    result = {'n': n, 'seconds': seconds, 'throughput': n / seconds}
+
+    if trace_memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            run()
+            result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def run_within(experiment, fn):
+    """Call fn within an unobserved run of the given experiment, returning its result."""
+    experiment.command(fn)
+    run = experiment.run(fn.__name__, options={'--unobserved': True})
+    return run.result
+
+
+@ex.capture
+def get_data(
+        scale,
+        _log,
+        data_dir='benchmarks',
+        n_docs=1000,
+        vocab_size=50000,
+        vectors_vocab_size=10000,
+        dim=100,
+        n_analogies=500,
+        data_seed=0):
+    """Get the synthetic data directory of the given scale, generating it if needed."""
+    params = {
+        'years': [(product, begin, end) for product, _, begin, end in get_year_ranges(path='')],
+        'n_docs': n_docs * scale,
+        'vocab_size': vocab_size,
+        'vectors_vocab_size': vectors_vocab_size * scale,
+        'dim': dim,
+        'n_analogies': n_analogies * scale,
+        'seed': data_seed,
+    }
+    path = Path(data_dir) / f'scale-{scale}'
+    params_path = path / 'params.json'
+    # round trip through JSON so the year ranges compare equal to the saved ones
+    params = json.loads(json.dumps(params))
+    if params_path.exists():
+        with open(params_path) as f:
+            if json.load(f) == params:
+                return path
+
+    _log.info('Generating synthetic data of scale %s in %s', scale, path)
+    write_dataset(path, **params)
+    with open(params_path, 'w') as f:
+        json.dump(params, f, indent=2)
+    return path
+
+
+def get_commit():
+    """Get the current git commit and whether the working tree has changes."""
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=cwd)
+        status = subprocess.check_output(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=cwd)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit.decode().strip(), bool(status.strip())
+
+
+def _format_change(new, old):
+    return f'{new / old:.2f}x' if old else '-'
+
+
+@ex.command
+def compare(_log, save_to='benchmarks.json', base_path='benchmarks.base.json'):
+    """Compare benchmark results against the base results as a TSV table."""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(save_to) as f:
+        new = json.load(f)
+    _log.info('Comparing %s (%s) against %s (%s)',
+              save_to, new['commit'], base_path, base['commit'])
+
+    base_results = {(r['hot_path'], r['scale']): r for r in base['results']}
+    print('hot_path', 'scale', 'unit', 'base_throughput', 'throughput', 'speedup',
+          'base_peak_mb', 'peak_mb', 'memory', sep='\t')
+    for r in new['results']:
+        b = base_results.get((r['hot_path'], r['scale']))
+        if b is None:
+            continue
+        print(
+            r['hot_path'], r['scale'], r['unit'],
+            f"{b['throughput']:.1f}", f"{r['throughput']:.1f}",
+            _format_change(r['throughput'], b['throughput']),
+            f"{b.get('peak_mb', float('nan')):.1f}", f"{r.get('peak_mb', float('nan')):.1f}",
+            _format_change(r.get('peak_mb', 0), b.get('peak_mb', 0)),
+            sep='\t')
+
+
+@ex.automain
+def benchmark(
+        _log,
+        _run,
+        _config,
+        scales=(1, 10),
+        repeat=3,
+        trace_memory=True,
+        only=(),
+        save_to='benchmarks.json'):
+    """Benchmark the throughput and peak memory of hot paths on synthetic data.
+
+    The results are saved as JSON along with the git commit, so they can be compared
+    across commits with the compare command.
+    """
+    commit, dirty = get_commit()
+    if dirty:
+        _log.warning('Working tree has uncommitted changes')
+
+    results = []
+    for scale in scales:
+        path = get_data(scale)
+        for name, (setup, unit, experiment) in HOT_PATHS.items():
+            if only and name not in only:
+                continue
+
+            def run_benchmark():
+                return measure(setup(path), repeat=repeat, trace_memory=trace_memory)
+
+            _log.info('Benchmarking %s at scale %s', name, scale)
+            result = run_benchmark() if experiment is None else run_within(
+                experiment, run_benchmark)
+            result.update(hot_path=name, scale=scale, unit=unit)
+            results.append(result)
+
+            _log.info('%s: %.1f %s/s in %.3fs, peak memory %.1f MB', name,
+                      result['throughput'], unit, result['seconds'], result.get('peak_mb', 0))
+            _run.log_scalar(f'{name}({scale}).throughput', result['throughput'])
+            if 'peak_mb' in result:
+                _run.log_scalar(f'{name}({scale}).peak_mb', result['peak_mb'])
+
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'date': datetime.now().isoformat(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'config': _config,
+        'results': results,
+    }
+    with open(save_to, 'w') as f:
+        json.dump(report, f, indent=2)
+    _log.info('Saved benchmark results to %s', save_to)
+    _run.add_artifact(save_to)
@@ -17,9 +17,12 @@
 ##########################################################################
 
 from collections import defaultdict
-from typing import Tuple
+from functools import partial
+from multiprocessing import Pool
+from typing import Dict, List, Mapping, Optional, Tuple
+import glob
+import logging
 import os
-import random
 
 from gensim.models import KeyedVectors
 from sacred import Experiment
@@ -28,7 +31,13 @@ from sacred.utils import apply_backspaces_and_linefeeds
 from tqdm import trange
 import numpy as np
 
-ex = Experiment(name='id-word2vec-eval-ci')
+from ingredients.profiling import ing as profiling_ing, stage
+from utils.ivf_index import IVFIndex, get_index_mtime, nonzero_norms, read_index_config
+from utils.vector_store import VECTORS_FNAME, VectorStore, is_vector_store
+from utils.vocab_index import read_words
+from utils.word2vec_format import read_vectors_header
+
+ex = Experiment(name='id-word2vec-eval-ci', ingredients=[profiling_ing])
 ex.captured_out_filter = apply_backspaces_and_linefeeds
 
 # Setup Mongo observer
@@ -40,7 +49,7 @@ if mongo_url is not None and db_name is not None:
 
 @ex.config
 def default():
-    # path to the word vectors file
+    # path to the word vectors file (or vector store directory)
     vectors_path = 'vectors.txt'
     # path to the analogy task file in Google's format
     analogy_path = 'analogy.txt'
@@ -50,12 +59,45 @@ def default():
     lower = True
     # compute acccuracy at this number of most similar results
     at = 1
+    # also report accuracy at these ranks (computed from the same ranking pass)
+    report_at = [1, 5, 10]
+    # number of analogies to score at once (memory used is about batch_size * vocab * 4 bytes)
+    batch_size = 128
     # whether to skip analogy containing OOV words
     skip_oov = True
     # significance level
     alpha = 0.95
     # number of bootstrap samples
     n_samples = 1000
+    # max memory in bytes for the bootstrap indices and values drawn at once
+    bootstrap_max_bytes = 256 * 2**20
+    # nearest neighbour search to rank the answers with (exact, or ivf for an approximate
+    # inverted file index which is saved to <vectors_path>.ivf and reused)
+    search = 'exact'
+    # configuration of the ivf index
+    ivf = {
+        # number of k-means clusters (None == 4 * sqrt(vocab size))
+        'n_lists': None,
+        # number of clusters searched per query (more is slower but more accurate)
+        'nprobe': 16,
+        # number of k-means iterations
+        'n_iter': 10,
+        # number of vectors k-means is trained on (None == 256 per cluster)
+        'train_size': None,
+        # number of analogies to measure recall against exact search on
+        'recall_sample': 1000,
+    }
+    # path to the other word vectors file (for compare command)
+    other_vectors_path = 'other_vectors.txt'
+    # list of paths or a glob pattern of the word vectors to evaluate together (for
+    # evaluate_many command)
+    vectors_paths = []
+    # whether to restrict all word vectors to the words they all have (for evaluate_many
+    # command)
+    shared_vocab = False
+    # max number of word vectors evaluated at once (None == as many as fit in the
+    # available memory)
+    max_workers = None
 
 
 @ex.capture
@@ -63,31 +105,118 @@ def load_word_vectors(
         _log,
         vectors_path: str = 'vectors.txt',
         encoding: str = 'utf-8',
-) -> KeyedVectors:
-    _log.info('Loading word vectors from %s', vectors_path)
-    return KeyedVectors.load_word2vec_format(vectors_path, encoding=encoding)
+) -> VectorStore:
+    return open_word_vectors(vectors_path, _log, encoding=encoding)
+
+
+def open_word_vectors(path: str, logger, encoding: str = 'utf-8') -> VectorStore:
+    if is_vector_store(path):
+        logger.info('Opening vector store %s', path)
+        return VectorStore.load(path)
+
+    logger.info('Loading word vectors from %s', path)
+    kv = KeyedVectors.load_word2vec_format(path, encoding=encoding)
+    return VectorStore(kv.index2word, kv.vectors)
+
+
+def get_shape(path: str) -> Tuple[int, int]:
+    """Get the vocab size and dimension of a vectors file or vector store.
+
+    Vectors files can be in text or binary format, and gzipped.
+    """
+    if is_vector_store(path):
+        return np.load(os.path.join(path, VECTORS_FNAME), mmap_mode='r').shape
+    return read_vectors_header(path)
+
+
+@ex.capture
+def get_index(
+        store: VectorStore,
+        _log,
+        _rnd,
+        vectors_path: str = 'vectors.txt',
+        search: str = 'exact',
+        ivf: Optional[dict] = None,
+) -> Optional[IVFIndex]:
+    """Load the search index of the vectors, building it first if needed.
+
+    Returns None for exact search.
+    """
+    if search == 'exact':
+        return None
+    if search != 'ivf':
+        raise ValueError(f'unknown search: {search}')
+    return load_ivf_index(store, vectors_path, ivf, _rnd, _log)
+
+
+def load_ivf_index(
+        store: VectorStore,
+        vectors_path: str,
+        ivf: dict,
+        rng: np.random.RandomState,
+        logger,
+) -> IVFIndex:
+    """Load the ivf index of the vectors, building and saving it first if it's out of date."""
+    n_lists = ivf['n_lists'] or int(4 * np.sqrt(len(store)))
+    index_config = {
+        'n_lists': n_lists,
+        'n_iter': ivf['n_iter'],
+        'train_size': ivf['train_size'],
+        'vocab_size': len(store),
+    }
+    index_path = f'{vectors_path.rstrip(os.sep)}.ivf'
+    # a directory's mtime doesn't change when its files are rewritten, so check the file
+    vectors_file = vectors_path
+    if is_vector_store(vectors_path):
+        vectors_file = os.path.join(vectors_path, VECTORS_FNAME)
+    if (read_index_config(index_path) == index_config
+            and get_index_mtime(index_path) >= os.path.getmtime(vectors_file)):
+        logger.info('Loading ivf index from %s', index_path)
+        return IVFIndex.load(index_path)
+
+    logger.info('Building ivf index with %d clusters', n_lists)
+    index = IVFIndex.build(
+        store.vectors,
+        store.norms,
+        n_lists,
+        n_iter=ivf['n_iter'],
+        train_size=ivf['train_size'],
+        rng=rng)
+    logger.info('Saving ivf index to %s', index_path)
+    index.save(index_path, config=index_config)
+    return index
 
 
 Analogy = Tuple[str, str, str, str]
 
 
 @ex.capture
-def is_correct(kv: KeyedVectors, analogy: Analogy, at: int = 1) -> bool:
-    pos = analogy[0].split('/') + analogy[2].split('/')
-    neg = analogy[1].split('/')
-    tgt = analogy[3].split('/')
+def bootstrap_means(samples, _rnd, n_samples=1000, bootstrap_max_bytes=256 * 2**20):
+    """Compute means of bootstrap resamples of the given samples.
+
+    Resamples are drawn in chunks whose indices and values take at most
+    ``bootstrap_max_bytes`` together. The means are nan if there are no samples.
+    """
+    samples = np.asarray(samples, dtype=np.float64)
+    if len(samples) == 0:
+        return np.full(n_samples, np.nan)
+    # an int64 index and a float64 value per resampled item
+    chunk_size = max(1, bootstrap_max_bytes // (16 * len(samples)))
+
+    bs_means = np.empty(n_samples)
+    for start in trange(0, n_samples, chunk_size):
+        size = min(chunk_size, n_samples - start)
+        indices = _rnd.choice(len(samples), size=(size, len(samples)))
+        bs_means[start:start + size] = samples[indices].mean(axis=1)
 
-    sim_words = set(w for w, _ in kv.most_similar(positive=pos, negative=neg, topn=at))
-    return any(t in sim_words for t in tgt)
+    return bs_means
 
 
 @ex.capture
-def compute_bootstrap_ci(samples, _log, alpha=0.95, n_samples=1000):
+def compute_bootstrap_ci(samples, _log, alpha=0.95):
     # See https://www2.stat.duke.edu/~banks/111-lectures.dir/lect13.pdf
     _log.info('Computing confidence interval via bootstrapping')
-    bs_means = []
-    for _ in trange(n_samples):
-        bs_means.append(np.mean(random.choices(samples, k=len(samples))))
+    bs_means = bootstrap_means(samples)
 
     qlo = 0.5 * (1 - alpha)
     qhi = 1 - qlo
@@ -97,8 +226,29 @@ def compute_bootstrap_ci(samples, _log, alpha=0.95, n_samples=1000):
 
 
 @ex.capture
-def get_corrects(kv, stream, _log, lower=True, skip_oov=True):
-    corrects = defaultdict(list)
+def paired_bootstrap_test(samples, other_samples, _log, alpha=0.95):
+    """Test whether two paired samples have different means.
+
+    Returns the mean difference, its bootstrap confidence interval, and the two-sided
+    p-value of the null hypothesis that the difference is zero.
+    """
+    _log.info('Running paired bootstrap test')
+    diffs = np.asarray(samples, dtype=np.float64) - np.asarray(other_samples, dtype=np.float64)
+    bs_means = bootstrap_means(diffs)
+
+    qlo = 0.5 * (1 - alpha)
+    qhi = 1 - qlo
+    bs_mean_lo, bs_mean_hi = np.quantile(bs_means, [qlo, qhi])
+    mean = np.mean(diffs)
+    # the bootstrap distribution is shifted to be centered at zero under the null
+    pvalue = np.mean(np.abs(bs_means - mean) >= np.abs(mean))
+    return mean, (2 * mean - bs_mean_hi, 2 * mean - bs_mean_lo), pvalue
+
+
+@ex.capture
+def read_analogies(stream, lower=True) -> List[Tuple[str, Analogy]]:
+    """Parse (section, analogy) pairs from an analogy file in Google's format."""
+    analogies = []
     section = ''
 
     for linum, line in enumerate(stream, 1):
@@ -111,54 +261,458 @@ def get_corrects(kv, stream, _log, lower=True, skip_oov=True):
             if len(analogy) != 4:
                 raise ValueError(
                     f'analogy at line {linum} has {len(analogy)} entries, expected 4')
+            analogies.append((section, analogy))
+
+    return analogies
 
-            try:
-                correct = is_correct(kv, analogy)
-            except KeyError as e:
-                if skip_oov:
-                    _log.debug('%s, skipping', e)
-                    continue
-                else:
-                    _log.debug('%s, assuming incorrect', e)
-                    correct = False
-            corrects[section].append(1 if correct else 0)
 
-    return corrects
+def encode_analogies(
+        analogies: List[Tuple[str, Analogy]],
+        word2index: Mapping[str, int],
+) -> Tuple[List[List[Tuple[int, float]]], List[List[int]], List[bool]]:
+    """Turn analogies into vocabulary indices.
+
+    Returns the weighted query indices (+1 for positive, -1 for negative words, exactly
+    as passed to gensim's ``most_similar``), the in-vocabulary target indices, and
+    whether each analogy has an OOV query word.
+    """
+    queries, targets, oovs = [], [], []
+    for _, analogy in analogies:
+        pos = analogy[0].split('/') + analogy[2].split('/')
+        neg = analogy[1].split('/')
+        tgt = analogy[3].split('/')
+
+        query = [(word2index.get(w), 1.0) for w in pos]
+        query += [(word2index.get(w), -1.0) for w in neg]
+        oov = any(i is None for i, _ in query)
+        queries.append([] if oov else query)
+        # OOV targets can never be among the most similar words
+        targets.append([word2index[w] for w in tgt if w in word2index])
+        oovs.append(oov)
+
+    return queries, targets, oovs
+
+
+def make_query_vectors(vectors, norms, n_queries, q_rows, q_cols, q_wts) -> np.ndarray:
+    mean = np.zeros((n_queries, vectors.shape[1]), dtype=vectors.dtype)
+    q_norms = nonzero_norms(norms[q_cols])
+    np.add.at(mean, q_rows, q_wts[:, None] * (vectors[q_cols] / q_norms[:, None]))
+    # normalizing the query does not change the ordering, so it's skipped
+    return mean
+
+
+def score_queries(vectors, norms, mean, q_rows, q_cols) -> np.ndarray:
+    """Score query vectors against the whole vocabulary, excluding the query words."""
+    dists = mean @ vectors.T
+    # zero vectors score zero instead of nan, which would break the rank counts
+    dists /= nonzero_norms(norms)
+    dists[q_rows, q_cols] = -np.inf
+    return dists
+
+
+def _flatten_queries(queries, dtype):
+    q_rows = np.array([r for r, q in enumerate(queries) for _ in q], dtype=np.int64)
+    q_cols = np.array([i for q in queries for i, _ in q], dtype=np.int64)
+    q_wts = np.array([w for q in queries for _, w in q], dtype=dtype)
+    return q_rows, q_cols, q_wts
+
+
+def rank_analogies(
+        vectors: np.ndarray,
+        norms: np.ndarray,
+        queries: List[List[Tuple[int, float]]],
+        targets: List[List[int]],
+        batch_size: int = 128,
+        index: Optional[IVFIndex] = None,
+        nprobe: int = 16,
+) -> np.ndarray:
+    """Compute the rank of the best target word of every analogy query.
+
+    Each block of queries is scored against the whole vocabulary with a single matrix
+    product, or against the words in the searched clusters if an index is given. Query
+    words are excluded from the ranking as ``most_similar`` does. Analogies whose targets
+    cannot be ranked (empty query or no reachable target) get rank infinity.
+    """
+    ranks = np.full(len(queries), np.inf)
+
+    for start in trange(0, len(queries), batch_size):
+        block_qs = queries[start:start + batch_size]
+        block_ts = targets[start:start + batch_size]
+
+        q_rows, q_cols, q_wts = _flatten_queries(block_qs, vectors.dtype)
+        t_rows = np.array([r for r, t in enumerate(block_ts) for _ in t], dtype=np.int64)
+        t_cols = np.array([i for t in block_ts for i in t], dtype=np.int64)
+
+        mean = make_query_vectors(vectors, norms, len(block_qs), q_rows, q_cols, q_wts)
+        if index is not None:
+            best, block_ranks = index.rank(
+                vectors, norms, mean, (q_rows, q_cols), (t_rows, t_cols), nprobe=nprobe)
+        else:
+            dists = score_queries(vectors, norms, mean, q_rows, q_cols)
+            best = np.full(len(block_qs), -np.inf, dtype=dists.dtype)
+            np.maximum.at(best, t_rows, dists[t_rows, t_cols])
+            block_ranks = 1 + (dists > best[:, None]).sum(axis=1)
+
+        valid = np.isfinite(best)
+        valid[[r for r, q in enumerate(block_qs) if not q]] = False
+        ranks[start:start + len(block_qs)][valid] = block_ranks[valid]
+
+    return ranks
+
+
+@ex.capture
+def get_all_ranks(
+        store: VectorStore,
+        analogies: List[Tuple[str, Analogy]],
+        _log,
+        index: Optional[IVFIndex] = None,
+        batch_size: int = 128,
+        ivf: Optional[dict] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Rank the answer of every analogy, returning the ranks and OOV flags."""
+    return rank_all_analogies(
+        store,
+        analogies,
+        _log,
+        index=index,
+        batch_size=batch_size,
+        nprobe=ivf['nprobe'] if index is not None else 0)
+
+
+def rank_all_analogies(
+        store: VectorStore,
+        analogies: List[Tuple[str, Analogy]],
+        logger,
+        index: Optional[IVFIndex] = None,
+        batch_size: int = 128,
+        nprobe: int = 16,
+) -> Tuple[np.ndarray, np.ndarray]:
+    queries, targets, oovs = encode_analogies(analogies, store.word2index)
+    logger.info('Found %d analogies, %d of them have OOV words', len(analogies), sum(oovs))
+    ranks = rank_analogies(
+        store.vectors,
+        store.norms,
+        queries,
+        targets,
+        batch_size=batch_size,
+        index=index,
+        nprobe=nprobe)
+    return ranks, np.array(oovs, dtype=bool)
+
+
+@ex.capture
+def measure_recall(
+        store: VectorStore,
+        index: IVFIndex,
+        analogies: List[Tuple[str, Analogy]],
+        _rnd,
+        at=1,
+        report_at=(1, 5, 10),
+        batch_size: int = 128,
+        ivf: Optional[dict] = None,
+) -> Tuple[int, float]:
+    """Measure the recall@k of the index against exact search on a sample of analogies.
+
+    Returns k, which is the largest rank accuracy is reported at, and the recall.
+    """
+    queries, _, oovs = encode_analogies(analogies, store.word2index)
+    queries = [q for q, oov in zip(queries, oovs) if not oov]
+    k = min(max([at, *report_at]), len(store) - 1)
+    n_samples = min(ivf['recall_sample'], len(queries))
+    if n_samples == 0:
+        return k, float('nan')
+    sample = _rnd.choice(len(queries), size=n_samples, replace=False)
+
+    total = 0.
+    for start in range(0, n_samples, batch_size):
+        block_qs = [queries[i] for i in sample[start:start + batch_size]]
+        q_rows, q_cols, q_wts = _flatten_queries(block_qs, store.vectors.dtype)
+        mean = make_query_vectors(
+            store.vectors, store.norms, len(block_qs), q_rows, q_cols, q_wts)
+        dists = score_queries(store.vectors, store.norms, mean, q_rows, q_cols)
+        neighbors = np.argpartition(-dists, k - 1, axis=1)[:, :k]
+        total += index.recall(mean, neighbors, nprobe=ivf['nprobe']) * len(block_qs)
+    return k, total / n_samples
+
+
+def group_by_section(analogies, values) -> Dict[str, np.ndarray]:
+    grouped = defaultdict(list)
+    for (section, _), value in zip(analogies, values):
+        grouped[section].append(value)
+    return {sec: np.array(vs) for sec, vs in grouped.items()}
+
+
+def concat_sections(values: Dict[str, np.ndarray]) -> np.ndarray:
+    """Concatenate the values of all sections, which is empty if there are no sections."""
+    if not values:
+        return np.array([])
+    return np.concatenate(list(values.values()))
+
+
+@ex.capture
+def get_ranks(store, analogies, _log, index=None, skip_oov=True) -> Dict[str, np.ndarray]:
+    """Rank the answer of every analogy, grouped by section."""
+    ranks, oovs = get_all_ranks(store, analogies, index=index)
+    if skip_oov:
+        _log.debug('Skipping analogies with OOV words')
+        analogies = [a for a, oov in zip(analogies, oovs) if not oov]
+        ranks = ranks[~oovs]
+    else:
+        _log.debug('Assuming analogies with OOV words are incorrect')
+
+    return group_by_section(analogies, ranks)
+
+
+@ex.capture
+def get_corrects(store, stream, at=1):
+    ranks = get_ranks(store, read_analogies(stream), index=get_index(store))
+    return {sec: [1 if r <= at else 0 for r in rs] for sec, rs in ranks.items()}
 
 
 @ex.command
 def print_corrects(_log, analogy_path: str = 'analogy.txt'):
     """Print 0/1 labels indicating if the analogy is correct/not."""
-    kv = load_word_vectors()
+    store = load_word_vectors()
     _log.info('Reading analogies from %s', analogy_path)
     with open(analogy_path) as f:
-        corrects = get_corrects(kv, f)
+        corrects = get_corrects(store, f)
     for sec in sorted(corrects):
         cs = corrects[sec]
         print('\n'.join(str(c) for c in cs))
 
 
+@ex.command
+def compare(
+        _log,
+        _run,
+        analogy_path: str = 'analogy.txt',
+        other_vectors_path: str = 'other_vectors.txt',
+        at=1,
+        skip_oov=True):
+    """Compare two word vectors on the same analogies with a paired bootstrap test."""
+    _log.info('Reading analogies from %s', analogy_path)
+    with open(analogy_path) as f:
+        analogies = read_analogies(f)
+
+    store = load_word_vectors()
+    ranks, oovs = get_all_ranks(store, analogies, index=get_index(store))
+    other_store = load_word_vectors(vectors_path=other_vectors_path)
+    other_ranks, other_oovs = get_all_ranks(
+        other_store,
+        analogies,
+        index=get_index(other_store, vectors_path=other_vectors_path))
+
+    keep = np.ones(len(analogies), dtype=bool)
+    if skip_oov:
+        keep = ~(oovs | other_oovs)
+        _log.info('Skipping %d analogies with OOV words in either vectors', (~keep).sum())
+    analogies = [a for a, k in zip(analogies, keep) if k]
+    corrects = group_by_section(analogies, (ranks[keep] <= at).astype(np.float64))
+    other_corrects = group_by_section(analogies, (other_ranks[keep] <= at).astype(np.float64))
+    corrects['**overall**'] = concat_sections(corrects)
+    other_corrects['**overall**'] = concat_sections(other_corrects)
+
+    _log.info('Accuracy differences:')
+    for sec in corrects:
+        diff, (diff_lo, diff_hi), pvalue = paired_bootstrap_test(
+            corrects[sec], other_corrects[sec])
+        _run.log_scalar(f'acc_diff({sec})', diff)
+        _run.log_scalar(f'acc_diff_lo({sec})', diff_lo)
+        _run.log_scalar(f'acc_diff_hi({sec})', diff_hi)
+        _run.log_scalar(f'pvalue({sec})', pvalue)
+        _log.info(f'{sec} : {diff:+.2%} [{diff_lo:+.2%}, {diff_hi:+.2%}] (p = {pvalue:.4f})')
+
+    return np.mean(corrects['**overall**']) - np.mean(other_corrects['**overall**'])
+
+
+@ex.capture
+def get_pool_size(paths, _log, batch_size=128, max_workers=None):
+    """Get the number of word vectors that can be evaluated at once in available memory."""
+    memory = 0
+    for path in paths:
+        vocab_size, dim = get_shape(path)
+        # loading a text file takes about twice the size of the matrix at its peak, and
+        # ranking a batch of analogies takes batch_size scores per word
+        factor = 1 if is_vector_store(path) else 2
+        memory = max(memory, 4 * vocab_size * (factor * dim + batch_size))
+    available = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+    pool_size = max(1, min(len(paths), os.cpu_count(), available // memory))
+    if max_workers is not None:
+        pool_size = min(pool_size, max_workers)
+    _log.info(
+        'Evaluating %d word vectors at once, each taking up to %.0f MB',
+        pool_size, memory / 2**20)
+    return pool_size
+
+
+def _read_vocab(path, encoding='utf-8'):
+    return list(read_words(path, encoding=encoding))
+
+
+# the state of an evaluate_many worker, which is set once by _init_worker so it isn't
+# pickled for every task
+_worker = {}
+
+
+def _init_worker(analogies, shared_vocab, encoding, search, ivf, batch_size, log_name):
+    _worker.update(
+        analogies=analogies,
+        shared_vocab=shared_vocab,
+        encoding=encoding,
+        search=search,
+        ivf=ivf,
+        batch_size=batch_size,
+        logger=logging.getLogger(log_name))
+
+
+def _rank_vectors(task):
+    path, seed = task
+    logger = _worker['logger']
+    store = open_word_vectors(path, logger, encoding=_worker['encoding'])
+    index = None
+    if _worker['shared_vocab'] is not None:
+        # no index, since a saved index only covers the full vocab
+        shared_vocab = _worker['shared_vocab']
+        rows = [i for i, w in enumerate(store.words) if w in shared_vocab]
+        store = VectorStore(
+            [store.words[i] for i in rows], store.vectors[rows], norms=store.norms[rows])
+    elif _worker['search'] == 'ivf':
+        index = load_ivf_index(
+            store, path, _worker['ivf'], np.random.RandomState(seed), logger)
+    return rank_all_analogies(
+        store,
+        _worker['analogies'],
+        logger,
+        index=index,
+        batch_size=_worker['batch_size'],
+        nprobe=_worker['ivf']['nprobe'] if index is not None else 0)
+
+
+@ex.command
+def evaluate_many(
+        _log,
+        _run,
+        _rnd,
+        analogy_path: str = 'analogy.txt',
+        vectors_paths=(),
+        encoding: str = 'utf-8',
+        search: str = 'exact',
+        ivf=None,
+        batch_size: int = 128,
+        shared_vocab=False,
+        at=1,
+        skip_oov=True):
+    """Evaluate several word vectors on the same analogies, printing a table of accuracies.
+
+    The analogies, shared vocab, and configs are passed to the worker processes when they
+    start, so this works with any multiprocessing start method.
+    """
+    if search not in ('exact', 'ivf'):
+        raise ValueError(f'unknown search: {search}')
+    if isinstance(vectors_paths, str):
+        # skip the ivf indexes saved next to the vectors
+        paths = [p for p in sorted(glob.glob(vectors_paths)) if not p.endswith('.ivf')]
+    else:
+        paths = list(vectors_paths)
+    if not paths:
+        raise ValueError('no word vectors to evaluate')
+    _log.info('Reading analogies from %s', analogy_path)
+    with open(analogy_path) as f:
+        all_analogies = read_analogies(f)
+
+    pool_size = get_pool_size(paths)
+    vocab = None
+    if shared_vocab:
+        _log.info('Finding the words all %d word vectors have', len(paths))
+        with Pool(pool_size) as pool:
+            read_fn = partial(_read_vocab, encoding=encoding)
+            for k, words in enumerate(pool.imap(read_fn, paths)):
+                vocab = set(words) if k == 0 else vocab & set(words)
+        _log.info('Found %d shared words', len(vocab))
+        if search != 'exact':
+            _log.warning('Using exact search since saved indexes cover the full vocab only')
+
+    # one seed per word vectors, so the ivf indexes don't depend on which worker builds them
+    tasks = list(zip(paths, _rnd.choice(2**31, size=len(paths)).tolist()))
+    initargs = (all_analogies, vocab, encoding, search, ivf, batch_size, _log.name)
+    results = {}
+    with Pool(pool_size, initializer=_init_worker, initargs=initargs) as pool:
+        for path, (ranks, oovs) in zip(paths, pool.imap(_rank_vectors, tasks)):
+            analogies = all_analogies
+            if skip_oov:
+                analogies = [a for a, oov in zip(analogies, oovs) if not oov]
+                ranks = ranks[~oovs]
+            corrects = group_by_section(analogies, (ranks <= at).astype(np.float64))
+            corrects['**overall**'] = concat_sections(corrects)
+
+            results[path] = {}
+            for sec, cs in corrects.items():
+                acc, (acc_lo, acc_hi) = np.mean(cs), compute_bootstrap_ci(cs)
+                results[path][sec] = {'acc': acc, 'acc_lo': acc_lo, 'acc_hi': acc_hi}
+                for name, value in results[path][sec].items():
+                    _run.log_scalar(f'{name}({path})({sec})', value)
+            _log.info(f'{path} : {results[path]["**overall**"]["acc"]:.2%}')
+    _run.info['results'] = results
+
+    sections = sorted({sec for res in results.values() for sec in res} - {'**overall**'})
+    print('\t'.join(['section', *paths]))
+    for sec in sections + ['**overall**']:
+        cells = []
+        for path in paths:
+            res = results[path].get(sec)
+            cells.append(
+                '-' if res is None else
+                f'{res["acc"]:.2%} [{res["acc_lo"]:.2%}, {res["acc_hi"]:.2%}]')
+        print('\t'.join([sec, *cells]))
+
+    return {path: res['**overall**']['acc'] for path, res in results.items()}
+
+
 @ex.automain
-def evaluate(_log, _run, analogy_path: str = 'analogy.txt'):
+def evaluate(_log, _run, analogy_path: str = 'analogy.txt', at=1, report_at=(1, 5, 10)):
     """Evaluate a given word vectors on word analogy task."""
-    kv = load_word_vectors()
+    with stage('load_vectors'):
+        store = load_word_vectors()
+        index = get_index(store)
     _log.info('Reading analogies from %s', analogy_path)
     with open(analogy_path) as f:
-        corrects = get_corrects(kv, f)
+        analogies = read_analogies(f)
+    with stage('rank'):
+        ranks = get_ranks(store, analogies, index=index)
+    if not ranks:
+        _log.warning('No analogies to evaluate')
+    ranks['**overall**'] = concat_sections(ranks)
+
+    if index is not None:
+        k, recall = measure_recall(store, index, analogies)
+        _run.log_scalar(f'ivf_recall@{k}', recall)
+        _log.info(f'Recall@{k} of ivf search against exact search: {recall:.2%}')
+
     _log.info('Accuracies:')
-    for sec, cs in corrects.items():
-        acc = np.mean(cs)
+    for sec, rs in ranks.items():
+        acc = np.mean(rs <= at)
         _run.log_scalar(f'acc({sec})', acc)
         _log.info(f'{sec} : {acc:.2%}')
 
-    all_corrects = [c for cs in corrects.values() for c in cs]
-    acc = np.mean(all_corrects)
-    _run.log_scalar('acc(**overall**)', acc)
-    _log.info(f'**overall** : {acc:.2%}')
+    for k in report_at:
+        _log.info(f'Accuracies@{k}:')
+        for sec, rs in ranks.items():
+            acc_k = np.mean(rs <= k)
+            _run.log_scalar(f'acc@{k}({sec})', acc_k)
+            _log.info(f'{sec} : {acc_k:.2%}')
+
+    _log.info('Mean reciprocal ranks:')
+    for sec, rs in ranks.items():
+        mrr = np.mean(1 / rs)
+        _run.log_scalar(f'mrr({sec})', mrr)
+        _log.info(f'{sec} : {mrr:.4f}')
 
-    acc_lo, acc_hi = compute_bootstrap_ci(all_corrects)
-    _run.log_scalar('acc_lo(**overall**)', acc_lo)
-    _run.log_scalar('acc_hi(**overall**)', acc_hi)
-    _log.info(f'Confidence interval: [{acc_lo:.2%}, {acc_hi:.2%}]')
+    _log.info('Confidence intervals:')
+    with stage('bootstrap'):
+        for sec, rs in ranks.items():
+            acc_lo, acc_hi = compute_bootstrap_ci((rs <= at).astype(np.float64))
+            _run.log_scalar(f'acc_lo({sec})', acc_lo)
+            _run.log_scalar(f'acc_hi({sec})', acc_hi)
+            _log.info(f'{sec} : [{acc_lo:.2%}, {acc_hi:.2%}]')
 
-    return acc
+    return np.mean(ranks['**overall**'] <= at)
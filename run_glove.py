@@ -17,14 +17,25 @@
 ##########################################################################
 
 from pathlib import Path
+import hashlib
+import json
 import os
+import subprocess
 import sys
+import time
 
 from sacred import Experiment
 from sacred.observers import MongoObserver
 from sacred.utils import apply_backspaces_and_linefeeds
 
-ex = Experiment(name='id-word2vec-default-glove')
+from ingredients.cache import ing as cache_ing, get_file_fingerprint, get_key_config, iter_lines
+from ingredients.corpus import ing as corpus_ing
+from ingredients.preprocess import ing as prep_ing
+from ingredients.profiling import ing as profiling_ing
+
+ex = Experiment(
+    name='id-word2vec-default-glove',
+    ingredients=[corpus_ing, prep_ing, cache_ing, profiling_ing])
 ex.captured_out_filter = apply_backspaces_and_linefeeds
 
 # Setup Mongo observer
@@ -37,7 +48,11 @@ if mongo_url is not None and db_name is not None:
 @ex.config
 def default():
     # path to the corpus file
-    corpus = 'corpus.txt'
+    corpus_file = 'corpus.txt'
+    # whether to stream the corpus (configured by the corpus ingredient) instead of reading
+    # from corpus_file (vocab_count and cooccur each preprocess the corpus again, unless
+    # cache.enabled=True)
+    stream = False
     # dimension of the word embedding
     size = 100
     # context window size
@@ -52,6 +67,10 @@ def default():
     outdir = 'output'
     # glove binary directory (empty string == binaries are in PATH)
     bindir = ''
+    # memory budget in GB for cooccur and shuffle (None == 80% of the available RAM)
+    memory = None
+    # whether to rerun stages whose outputs are up to date
+    force = False
 
 
 VOCAB_FNAME = 'vocab.txt'
@@ -60,41 +79,148 @@ SHUF_FNAME = 'cooccurences.shuf.bin'
 VECTORS_FNAME = 'vectors'
 
 
-def runcmd(cmd):
-    rc = os.system(cmd)
+@ex.capture
+def runcmd(cmd, _log, _run, stdin=None, stdout=None, lines=None):
+    """Run a GloVe binary, recording its wall time and peak RSS in the run.
+
+    If lines are given, they are fed to the binary's standard input.
+    """
+    name = os.path.basename(cmd[0])
+    _log.info('Running %s', ' '.join(cmd))
+    start_time = time.time()
+
+    proc = subprocess.Popen(
+        cmd, stdin=subprocess.PIPE if lines is not None else stdin, stdout=stdout)
+    if lines is not None:
+        try:
+            for line in lines:
+                proc.stdin.write(line.encode('utf-8'))
+                proc.stdin.write(b'\n')
+        except BrokenPipeError:
+            _log.warning('%s stopped reading its input', name)
+        except BaseException:
+            proc.kill()
+            raise
+        finally:
+            if hasattr(lines, 'close'):
+                # stops the corpus workers if the binary didn't read everything
+                lines.close()
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    # wait4 (instead of proc.wait) gives the resource usage of this child only
+    _, status, rusage = os.wait4(proc.pid, 0)
+    rc = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    proc.returncode = rc
+    wall_time = time.time() - start_time
+    # ru_maxrss is in KB, and on Linux it can't be lower than this process's RSS at fork
+    peak_rss = rusage.ru_maxrss / 2**10
+
+    _run.log_scalar(f'{name}.wall_time', wall_time)
+    _run.log_scalar(f'{name}.peak_rss_mb', peak_rss)
+    _log.info('%s finished in %.1fs with peak RSS %.1f MB', name, wall_time, peak_rss)
     if rc != 0:
         sys.exit(rc)
 
 
+@ex.capture
+def get_corpus_fingerprint(_run, corpus_file, stream=False):
+    if stream:
+        # includes the size and mtime of every corpus file
+        return get_key_config(_run.config)
+    return get_file_fingerprint(Path(corpus_file))
+
+
+def _stamp_path(output):
+    return output.with_name(output.name + '.stamp')
+
+
+def get_digest(output):
+    """Get the digest of a stage output, or fingerprint it if it wasn't made by a stage."""
+    stamp = _stamp_path(output)
+    if stamp.exists():
+        with open(stamp) as f:
+            stamp = json.load(f)
+        if stamp['output'] == get_file_fingerprint(output):
+            return stamp['digest']
+    return get_file_fingerprint(output)
+
+
+@ex.capture
+def run_stage(name, output, params, inputs, run_fn, _log, force=False):
+    """Run a stage unless its output was made from the same inputs and parameters.
+
+    The digest of the inputs and parameters is saved next to the output, so later stages
+    can use it as their input fingerprint.
+    """
+    key = json.dumps({'stage': name, 'params': params, 'inputs': inputs}, sort_keys=True)
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    if not force and output.exists() and get_digest(output) == digest:
+        _log.info('Skipping %s, %s is up to date', name, output)
+        return
+
+    run_fn()
+    with open(_stamp_path(output), 'w') as f:
+        json.dump({'digest': digest, 'output': get_file_fingerprint(output)}, f)
+
+
+@ex.capture
+def get_memory(memory=None):
+    if memory is not None:
+        return memory
+    avail = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    return round(0.8 * avail / 2**30, 1)
+
+
 @ex.command
-def vocab_count(corpus, min_count=5, outdir='output', bindir=''):
+def vocab_count(corpus_file, min_count=5, outdir='output', bindir='', stream=False):
     """Run GloVe's vocab_count."""
     outdir = Path(outdir)
     outdir.mkdir(exist_ok=True)
     vocab = outdir / VOCAB_FNAME
 
-    cmd = os.path.join(bindir, 'vocab_count')
-    cmd += f' -min-count {min_count}'
-    cmd += f' < {corpus} > {vocab}'
+    cmd = [os.path.join(bindir, 'vocab_count')]
+    cmd += ['-min-count', str(min_count)]
 
-    runcmd(cmd)
+    def run():
+        with open(vocab, 'wb') as fout:
+            if stream:
+                runcmd(cmd, stdout=fout, lines=iter_lines())
+            else:
+                with open(corpus_file, 'rb') as fin:
+                    runcmd(cmd, stdin=fin, stdout=fout)
+
+    run_stage(
+        'vocab_count', vocab, {'min_count': min_count}, {'corpus': get_corpus_fingerprint()},
+        run)
 
 
 @ex.command
-def cooccur(corpus, window=10, outdir='output', bindir=''):
+def cooccur(corpus_file, window=10, outdir='output', bindir='', stream=False):
     """Run GloVe's cooccur."""
     outdir = Path(outdir)
     vocab = outdir / VOCAB_FNAME
     cooccur_path = outdir / COOCCUR_FNAME
     overflow = outdir / 'overflow'
 
-    cmd = os.path.join(bindir, 'cooccur')
-    cmd += f' -vocab-file {vocab}'
-    cmd += f' -window-size {window}'
-    cmd += f' -overflow-file {overflow}'
-    cmd += f' < {corpus} > {cooccur_path}'
+    cmd = [os.path.join(bindir, 'cooccur')]
+    cmd += ['-vocab-file', str(vocab)]
+    cmd += ['-window-size', str(window)]
+    cmd += ['-overflow-file', str(overflow)]
+    cmd += ['-memory', str(get_memory())]
 
-    runcmd(cmd)
+    def run():
+        with open(cooccur_path, 'wb') as fout:
+            if stream:
+                runcmd(cmd, stdout=fout, lines=iter_lines())
+            else:
+                with open(corpus_file, 'rb') as fin:
+                    runcmd(cmd, stdin=fin, stdout=fout)
+
+    inputs = {'corpus': get_corpus_fingerprint(), 'vocab': get_digest(vocab)}
+    run_stage('cooccur', cooccur_path, {'window': window}, inputs, run)
 
 
 @ex.command
@@ -105,13 +231,17 @@ def shuffle(outdir='output', bindir=''):
     shuf = outdir / SHUF_FNAME
     temp = outdir / 'temp_shuffle'
 
-    cmd = os.path.join(bindir, 'shuffle')
+    cmd = [os.path.join(bindir, 'shuffle')]
     # verbose flag needed, see https://github.com/stanfordnlp/GloVe/issues/137
-    cmd += f' -verbose 2'
-    cmd += f' -temp-file {temp}'
-    cmd += f' < {cooccur_path} > {shuf}'
+    cmd += ['-verbose', '2']
+    cmd += ['-temp-file', str(temp)]
+    cmd += ['-memory', str(get_memory())]
 
-    runcmd(cmd)
+    def run():
+        with open(cooccur_path, 'rb') as fin, open(shuf, 'wb') as fout:
+            runcmd(cmd, stdin=fin, stdout=fout)
+
+    run_stage('shuffle', shuf, {}, {'cooccur': get_digest(cooccur_path)}, run)
 
 
 @ex.command
@@ -122,15 +252,15 @@ def glove(size=100, workers=1, epochs=50, outdir='output', bindir=''):
     shuf = outdir / SHUF_FNAME
     vectors = outdir / VECTORS_FNAME
 
-    cmd = os.path.join(bindir, 'glove')
-    cmd += f' -vector-size {size}'
-    cmd += f' -threads {workers}'
-    cmd += f' -iter {epochs}'
-    cmd += f' -input-file {shuf}'
-    cmd += f' -vocab-file {vocab}'
-    cmd += f' -save-file {vectors}'
-    cmd += f' -binary 0'  # save as text
-    cmd += f' -model 1'  # save only the word vectors
+    cmd = [os.path.join(bindir, 'glove')]
+    cmd += ['-vector-size', str(size)]
+    cmd += ['-threads', str(workers)]
+    cmd += ['-iter', str(epochs)]
+    cmd += ['-input-file', str(shuf)]
+    cmd += ['-vocab-file', str(vocab)]
+    cmd += ['-save-file', str(vectors)]
+    cmd += ['-binary', '0']  # save as text
+    cmd += ['-model', '1']  # save only the word vectors
 
     runcmd(cmd)
 
@@ -16,19 +16,30 @@
 # limitations under the License.
 ##########################################################################
 
-from itertools import chain
+from collections import Counter
+from pathlib import Path
+import json
 import os
+import threading
+import time
 import warnings
 
 from gensim.models import FastText, Word2Vec
+from gensim.models.callbacks import CallbackAny2Vec
 from gensim.models.word2vec import FAST_VERSION
 from sacred import Experiment
 from sacred.observers import MongoObserver
 
-from ingredients.corpus import ing as corpus_ing, read_corpus
-from ingredients.preprocess import ing as prep_ing, make_prep_sent
+from ingredients.cache import ing as cache_ing, get_key_config, read_prep_corpus
+from ingredients.corpus import ing as corpus_ing
+from ingredients.preprocess import ing as prep_ing
+from ingredients.profiling import ing as profiling_ing, stage
+from utils.vector_store import VectorStore
+from utils.word_freqs import read_word_freqs, write_word_freqs
 
-ex = Experiment(name='id-word2vec-default-word2vec', ingredients=[corpus_ing, prep_ing])
+ex = Experiment(
+    name='id-word2vec-default-word2vec',
+    ingredients=[corpus_ing, prep_ing, cache_ing, profiling_ing])
 
 # Setup Mongo observer
 mongo_url = os.getenv('SACRED_MONGO_URL')
@@ -45,40 +56,289 @@ def default():
     window = 15
     # discard words occurring fewer than this
     min_count = 5
+    # prune the least frequent words whenever the vocabulary grows beyond this while the
+    # corpus is scanned (None == no limit)
+    max_vocab_size = None
+    # raise min_count as needed to keep at most this many words (None == no limit)
+    max_final_vocab = None
+    # build the vocabulary from this word frequency file (one word and its count per line,
+    # e.g. written by the count_words command) instead of scanning the corpus (empty
+    # string == scan the corpus)
+    vocab_freq_path = ''
+    # keep only this many most frequent words of vocab_freq_path (None == keep all)
+    vocab_freq_top_n = None
     # number of epochs to train for
     epochs = 5
     # whether to use fastText instead
     use_fasttext = False
     # number of workers
     workers = os.cpu_count() - 1 if os.cpu_count() > 1 else 1
+    # whether to compute and log the training loss (word2vec only)
+    compute_loss = True
+    # train from this LineSentence file with gensim's corpus_file mode, writing the
+    # preprocessed corpus to it first unless it was written from the same corpus and
+    # preprocessing configs (empty string == train from the corpus iterable, which is
+    # limited to one producer thread)
+    corpus_file = ''
+    # directory to save a checkpoint to after every epoch (empty string == no checkpoints)
+    checkpoint_dir = ''
+    # checkpoint directory to resume training from (empty string == train from scratch)
+    resume_from = ''
     # whether to save the vectors only
     vectors_only = True
+    # save format (text, model, or store for a memory-mapped vector store directory)
+    save_format = 'text' if vectors_only else 'model'
     # where to save the result
     save_to = 'vectors.txt'
 
 
 class SentencesCorpus:
-    def __init__(self, read_corpus):
-        self.read_corpus = read_corpus
-        self.prep_sent = make_prep_sent()
+    def __init__(self, read_prep_corpus):
+        self.read_prep_corpus = read_prep_corpus
+        # total seconds spent reading documents, i.e. what gensim's producer waits on
+        self.read_time = 0.
 
     def __iter__(self):
-        for paras in self.read_corpus():
-            for sent in chain.from_iterable(paras):
-                yield self.prep_sent(sent)
+        docs = iter(self.read_prep_corpus())
+        while True:
+            start_time = time.perf_counter()
+            sents = next(docs, None)
+            self.read_time += time.perf_counter() - start_time
+            if sents is None:
+                return
+            yield from sents
+
+
+class TrainingMonitor(CallbackAny2Vec):
+    """Log per-epoch throughput, loss, and where training time goes as run scalars."""
+
+    def __init__(self, run, logger, corpus=None):
+        self.run = run
+        self.logger = logger
+        self.corpus = corpus
+        self.epoch = 0
+        self.effective_words = 0.
+        self.loss = 0.
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def on_train_begin(self, model):
+        # expected number of words left after frequent words are downsampled
+        self.effective_words = sum(
+            v.count * min(1., v.sample_int / 2**32) for v in model.wv.vocab.values())
+        self.loss = 0.
+
+    def on_epoch_begin(self, model):
+        self.epoch_start = time.time()
+        self.busy_time = 0.
+        self.read_time = self.corpus.read_time if self.corpus is not None else 0.
+
+    def on_batch_begin(self, model):
+        self._local.start_time = time.perf_counter()
+
+    def on_batch_end(self, model):
+        elapsed = time.perf_counter() - self._local.start_time
+        with self._lock:
+            self.busy_time += elapsed
+
+    def on_epoch_end(self, model):
+        wall_time = time.time() - self.epoch_start
+        metrics = {
+            'epoch_time': wall_time,
+            'words_per_sec': model.corpus_total_words / wall_time,
+            'effective_words': self.effective_words,
+            'effective_words_per_sec': self.effective_words / wall_time,
+        }
+        # gensim doesn't report batches in corpus_file mode
+        if self.busy_time > 0:
+            metrics['worker_busy_time'] = self.busy_time
+            metrics['worker_utilization'] = self.busy_time / (wall_time * model.workers)
+        if self.corpus is not None:
+            metrics['producer_read_time'] = self.corpus.read_time - self.read_time
+        if getattr(model, 'compute_loss', False):
+            # gensim accumulates the loss over the epochs of a train call
+            loss = model.get_latest_training_loss()
+            metrics['loss'] = loss - self.loss
+            self.loss = loss
+
+        for name, value in metrics.items():
+            self.run.log_scalar(name, value, self.epoch)
+        self.logger.info(
+            'Epoch %d: %s', self.epoch + 1,
+            ', '.join(f'{name} = {value:.4g}' for name, value in metrics.items()))
+        self.epoch += 1
+
+
+@ex.capture
+def write_line_corpus(corpus_file, _log, _run):
+    """Write the preprocessed corpus in LineSentence format, one sentence per line.
+
+    The corpus and preprocessing configs it was written from are saved next to it, and the
+    file is only reused if they match the current ones.
+    """
+    # includes the size and mtime of every corpus file
+    key_config = json.loads(json.dumps(get_key_config(_run.config)))
+    config_path = Path(f'{corpus_file}.config.json')
+    if Path(corpus_file).exists():
+        if config_path.exists():
+            with open(config_path) as f:
+                if json.load(f) == key_config:
+                    _log.info('Reusing preprocessed corpus in %s', corpus_file)
+                    return
+        _log.info('Preprocessed corpus in %s is out of date', corpus_file)
+
+    _log.info('Writing preprocessed corpus to %s', corpus_file)
+    tmp_path = Path(f'{corpus_file}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for sent in SentencesCorpus(read_prep_corpus):
+            if sent:
+                print(' '.join(sent), file=f)
+    tmp_path.rename(corpus_file)
+    with open(f'{config_path}.tmp', 'w') as f:
+        json.dump(key_config, f, indent=2, sort_keys=True)
+    os.replace(f'{config_path}.tmp', config_path)
+
+
+@ex.command
+def count_words(vocab_freq_path, _log):
+    """Count word frequencies in the preprocessed corpus for building the vocabulary."""
+    if not vocab_freq_path:
+        raise ValueError('vocab_freq_path must be set')
+    counts = Counter()
+    for sent in SentencesCorpus(read_prep_corpus):
+        counts.update(sent)
+    _log.info('Writing %d word frequencies to %s', len(counts), vocab_freq_path)
+    write_word_freqs(counts, vocab_freq_path)
+
+
+def get_physical_memory():
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+@ex.capture
+def check_memory(model, freqs, _log, _run, min_count=5, max_final_vocab=None):
+    """Log the estimated training memory, raising an error if it exceeds physical memory."""
+    vocab_size = sum(1 for count in freqs.values() if count >= min_count)
+    if max_final_vocab is not None:
+        vocab_size = min(vocab_size, max_final_vocab)
+    memory = model.estimate_memory(vocab_size=vocab_size)['total']
+    _run.log_scalar('estimated_memory_mb', memory / 2**20)
+    _log.info(
+        'Estimated memory for %d words and %d dimensions: %.0f MB',
+        vocab_size, model.vector_size, memory / 2**20)
+    if memory > get_physical_memory():
+        raise MemoryError(
+            f'training needs an estimated {memory / 2**20:.0f} MB which exceeds the physical '
+            'memory; increase min_count or set max_final_vocab')
+
+
+@ex.capture
+def build_vocab_from_freq(
+        model, _log, vocab_freq_path, max_vocab_size=None, vocab_freq_top_n=None):
+    """Build the model vocabulary from a word frequency file without scanning the corpus.
+
+    The memory needed for training is estimated before the weights are allocated. This
+    isn't supported for fastText, whose build_vocab_from_freq doesn't build the ngram
+    buckets like build_vocab does.
+    """
+    if isinstance(model, FastText):
+        raise ValueError('cannot build the fastText vocabulary from vocab_freq_path')
+    if max_vocab_size is not None:
+        _log.warning(
+            'max_vocab_size only prunes the vocabulary while scanning the corpus; use '
+            'vocab_freq_top_n to keep the most frequent words of %s', vocab_freq_path)
+    _log.info('Reading word frequencies from %s', vocab_freq_path)
+    freqs = read_word_freqs(vocab_freq_path)
+    total_words = sum(freqs.values())
+    if vocab_freq_top_n is not None and len(freqs) > vocab_freq_top_n:
+        _log.info('Keeping the %d most frequent of %d words', vocab_freq_top_n, len(freqs))
+        freqs = dict(sorted(freqs.items(), key=lambda x: -x[1])[:vocab_freq_top_n])
+
+    check_memory(model, freqs)
+    model.build_vocab_from_freq(freqs)
+    # gensim only knows the corpus size from a scan, and needs it to decay the learning rate
+    model.corpus_total_words = total_words
+
+
+@ex.capture
+def build_vocab_from_corpus(model, corpus_kwargs, _log):
+    """Build the model vocabulary by scanning the corpus.
+
+    Like build_vocab, but the memory needed for training is estimated after the scan and
+    before the weights are allocated. FastText models use build_vocab itself, since their
+    ngram buckets are only built there.
+    """
+    _log.info('Building vocabulary')
+    if isinstance(model, FastText):
+        _log.warning('Training memory is not estimated for fastText')
+        model.build_vocab(**corpus_kwargs)
+        return
+    total_words, corpus_count = model.vocabulary.scan_vocab(**corpus_kwargs)
+    freqs = model.vocabulary.raw_vocab
+    check_memory(model, freqs)
+    model.build_vocab_from_freq(freqs, corpus_count=corpus_count)
+    model.corpus_total_words = total_words
+
+
+CHECKPOINT_FNAME = 'checkpoint.json'
+
+
+@ex.capture
+def save_checkpoint(model, epoch, alphas, _log, checkpoint_dir=''):
+    """Atomically save the full model state after the given number of epochs.
+
+    The initial and final learning rates are saved too since gensim overwrites them with
+    those of the last epoch.
+    """
+    checkpoint_dir = Path(checkpoint_dir)
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    model_fname = f'epoch-{epoch}.model'
+    _log.info('Saving checkpoint to %s', checkpoint_dir / model_fname)
+
+    # the training monitor holds the run and can't be pickled
+    callbacks, model.callbacks = getattr(model, 'callbacks', ()), ()
+    # keep all arrays in one pickle so the checkpoint is a single file
+    model.save(str(checkpoint_dir / f'{model_fname}.tmp'), separately=[], pickle_protocol=4)
+    model.callbacks = callbacks
+    os.replace(checkpoint_dir / f'{model_fname}.tmp', checkpoint_dir / model_fname)
+
+    with open(checkpoint_dir / f'{CHECKPOINT_FNAME}.tmp', 'w') as f:
+        json.dump({'epoch': epoch, 'model': model_fname, 'alphas': alphas}, f)
+    os.replace(checkpoint_dir / f'{CHECKPOINT_FNAME}.tmp', checkpoint_dir / CHECKPOINT_FNAME)
+
+    for path in checkpoint_dir.glob('epoch-*.model'):
+        if path.name != model_fname:
+            path.unlink()
+
+
+def load_checkpoint(cls, checkpoint_dir):
+    """Load the model, the number of epochs done, and the learning rates from a checkpoint."""
+    checkpoint_dir = Path(checkpoint_dir)
+    with open(checkpoint_dir / CHECKPOINT_FNAME) as f:
+        checkpoint = json.load(f)
+    model = cls.load(str(checkpoint_dir / checkpoint['model']))
+    return model, checkpoint['epoch'], checkpoint['alphas']
 
 
 @ex.automain
 def train(
         seed,
         _log,
+        _run,
         size=100,
         window=5,
         min_count=5,
+        max_vocab_size=None,
+        max_final_vocab=None,
+        vocab_freq_path='',
         epochs=5,
         use_fasttext=False,
         workers=1,
-        vectors_only=True,
+        compute_loss=True,
+        corpus_file='',
+        checkpoint_dir='',
+        resume_from='',
+        save_format='text',
         save_to='vectors.txt'):
     """Train word2vec/fastText word vectors."""
     if not FAST_VERSION:
@@ -88,18 +348,68 @@ def train(
 
     cls = FastText if use_fasttext else Word2Vec
 
+    if corpus_file:
+        write_line_corpus()
+        corpus_kwargs = {'corpus_file': corpus_file}
+        monitor = TrainingMonitor(_run, _log)
+    else:
+        sentences = SentencesCorpus(read_prep_corpus)
+        corpus_kwargs = {'sentences': sentences}
+        monitor = TrainingMonitor(_run, _log, corpus=sentences)
+
+    if resume_from:
+        model, start_epoch, (alpha, min_alpha) = load_checkpoint(cls, resume_from)
+        _log.info('Resuming training from %s after epoch %d', resume_from, start_epoch)
+    else:
+        kwargs = dict(
+            size=size, window=window, min_count=min_count, max_vocab_size=max_vocab_size,
+            max_final_vocab=max_final_vocab, workers=workers, iter=epochs, seed=seed)
+        if not use_fasttext:
+            kwargs['compute_loss'] = compute_loss
+        model = cls(**kwargs)
+        with stage('build_vocab'):
+            if vocab_freq_path:
+                build_vocab_from_freq(model)
+            else:
+                build_vocab_from_corpus(model, corpus_kwargs)
+        start_epoch = 0
+        alpha, min_alpha = model.alpha, model.min_alpha
+
     _log.info('Start training')
-    model = cls(
-        SentencesCorpus(read_corpus),
-        size=size,
-        window=window,
-        min_count=min_count,
-        workers=workers,
-        iter=epochs,
-        seed=seed)
+    monitor.epoch = start_epoch
+    start_time = time.time()
+    with stage('train'):
+        for epoch in range(start_epoch, epochs):
+            # decay the learning rate linearly over all epochs, as a single train call would
+            alpha_step = (alpha - min_alpha) / epochs
+            model.train(
+                # the number of sentences is unknown if the vocabulary is built from
+                # frequencies
+                total_examples=model.corpus_count or None,
+                total_words=model.corpus_total_words,
+                epochs=1,
+                start_alpha=alpha - alpha_step * epoch,
+                end_alpha=alpha - alpha_step * (epoch + 1),
+                compute_loss=getattr(model, 'compute_loss', False),
+                callbacks=[monitor],
+                **corpus_kwargs)
+            if checkpoint_dir:
+                save_checkpoint(model, epoch + 1, [alpha, min_alpha])
+    elapsed = time.time() - start_time
+    model.alpha, model.min_alpha, model.epochs = alpha, min_alpha, epochs
+    words_per_sec = model.corpus_total_words * (epochs - start_epoch) / elapsed
+    _run.log_scalar('words_per_sec', words_per_sec)
+    _log.info('Processed %.0f words/sec', words_per_sec)
 
     _log.info('Training finished, saving model to %s', save_to)
-    if vectors_only:
-        model.wv.save_word2vec_format(save_to)
-    else:
-        model.save(save_to)
+    # the monitor holds the run and can't be pickled
+    model.callbacks = ()
+    with stage('save'):
+        if save_format == 'text':
+            model.wv.save_word2vec_format(save_to)
+        elif save_format == 'model':
+            model.save(save_to)
+        elif save_format == 'store':
+            VectorStore(model.wv.index2word, model.wv.vectors).save(save_to)
+        else:
+            raise ValueError(f'unknown save format: {save_format}')
@@ -0,0 +1,51 @@
+import json
+
+from sacred import Experiment
+import pytest
+
+from ingredients.cache import ing as cache_ing, open_cache, read_prep_corpus
+
+ex = Experiment('test-cache', ingredients=[cache_ing])
+
+
+@ex.command
+def read_docs():
+    return list(read_prep_corpus())
+
+
+@pytest.fixture
+def corpus_dir(tmp_path):
+    path = tmp_path / 'corpus'
+    (path / 'kt').mkdir(parents=True)
+    for year in (2005, 2006):
+        with open(path / 'kt' / f'{year}.jsonl', 'w', encoding='utf-8') as f:
+            for i in range(20):
+                # with a trailing newline, these are kept by the default word pattern
+                paras = [[['Kata', f'ke-{i}', str(year), '!'], ['Budi\n', '7\n']]
+                         for _ in range(i % 3)]
+                print(json.dumps({'paragraphs': paras}), file=f)
+    return path
+
+
+def run_read_docs(corpus_dir, **cache_config):
+    config_updates = {
+        'corpus': {'path': str(corpus_dir), 'product': 'kt', 'kt_begin': 2005, 'kt_end': 2006},
+        'cache': cache_config,
+    }
+    run = ex.run('read_docs', config_updates=config_updates, options={'--unobserved': True})
+    return run.result
+
+
+def test_read_cache_matches_uncached(corpus_dir, tmp_path):
+    docs = run_read_docs(corpus_dir, enabled=False)
+    assert len(docs) == 40 and docs[1] == [['kata', 'ke-1', '@@NUM@@'], ['budi\n', '@@NUM@@']]
+
+    cache_path = tmp_path / 'cache'
+    # the first run builds the cache, the second only reads it
+    assert run_read_docs(corpus_dir, enabled=True, path=str(cache_path)) == docs
+    assert run_read_docs(corpus_dir, enabled=True, path=str(cache_path)) == docs
+
+    cache_dir, = cache_path.iterdir()
+    vocab, tokens, sent_offsets, doc_offsets = open_cache(cache_dir)
+    assert len(doc_offsets) == len(docs) + 1
+    assert len(tokens) == sum(len(sent) for sents in docs for sent in sents)
@@ -0,0 +1,141 @@
+import gzip
+import json
+
+from sacred import Experiment
+import numpy as np
+import pytest
+
+from ingredients.corpus import (
+    DocSampler, ing as corpus_ing, map_corpus, read_block_index, read_corpus, read_doc,
+    read_file, write_bgzf)
+
+
+def make_lines(n_docs):
+    return [
+        json.dumps({'paragraphs': [[[f'kata{i}', f'ke-{j}'] for j in range(i % 5 + 1)]]})
+        .encode('utf-8') for i in range(n_docs)
+    ]
+
+
+def test_write_bgzf_round_trip(tmp_path):
+    lines = make_lines(100)
+    path = tmp_path / '2005.jsonl.bgz'
+    write_bgzf(iter(lines), path, block_bytes=512)
+
+    docs = list(read_file(path))
+    assert docs == [json.loads(line)['paragraphs'] for line in lines]
+    # a block gzip file is also a regular gzip file
+    with gzip.open(path, 'rb') as f:
+        assert f.read() == b''.join(line + b'\n' for line in lines)
+
+
+def test_write_bgzf_index(tmp_path):
+    lines = make_lines(100)
+    path = tmp_path / '2005.jsonl.bgz'
+    write_bgzf(iter(lines), path, block_bytes=512)
+
+    index = read_block_index(path)
+    offsets, first_docs = index[:, 0], index[:, 1]
+    assert len(index) > 2
+    assert offsets[0] == 0 and offsets[-1] == path.stat().st_size
+    assert first_docs[0] == 0 and first_docs[-1] == len(lines)
+    assert np.all(np.diff(offsets) > 0) and np.all(np.diff(first_docs) > 0)
+
+    data = path.read_bytes()
+    for k, (start, end) in enumerate(zip(offsets, offsets[1:])):
+        # every block is a gzip member holding whole documents
+        block = gzip.decompress(data[start:end])
+        assert block == b''.join(
+            line + b'\n' for line in lines[first_docs[k]:first_docs[k + 1]])
+
+
+def test_read_doc(tmp_path):
+    lines = make_lines(100)
+    path = tmp_path / '2005.jsonl.bgz'
+    write_bgzf(iter(lines), path, block_bytes=512)
+
+    for n in (0, 1, 37, 99):
+        assert read_doc(path, n) == json.loads(lines[n])['paragraphs']
+    with pytest.raises(IndexError):
+        read_doc(path, len(lines))
+
+
+def test_write_bgzf_is_deterministic(tmp_path):
+    lines = make_lines(50)
+    write_bgzf(iter(lines), tmp_path / 'a.jsonl.bgz', block_bytes=512)
+    write_bgzf(iter(lines), tmp_path / 'b.jsonl.bgz', block_bytes=512)
+    assert (tmp_path / 'a.jsonl.bgz').read_bytes() == (tmp_path / 'b.jsonl.bgz').read_bytes()
+
+
+
+def test_doc_sampler_is_deterministic():
+    lines = make_lines(1000)
+    kept = [DocSampler(rate=0.3, seed=1)(line) for line in lines]
+    # the decision only depends on the line, not on the order or the line ending
+    sampler = DocSampler(rate=0.3, seed=1)
+    assert [sampler(line + b'\r\n') for line in reversed(lines)] == kept[::-1]
+    assert sampler.n_seen == 1000 and sampler.n_kept == sum(kept)
+    assert 200 < sum(kept) < 400
+    assert [DocSampler(rate=0.3, seed=2)(line) for line in lines] != kept
+
+
+def test_doc_sampler_keeps_all():
+    sampler = DocSampler()
+    assert all(sampler(line) for line in make_lines(100))
+    assert sampler.n_kept == 100
+
+ex = Experiment('test-corpus', ingredients=[corpus_ing])
+
+
+def count_words(docs):
+    return [sum(len(sent) for para in paras for sent in para) for paras in docs]
+
+
+@ex.command
+def map_count_words():
+    return list(map_corpus(count_words))
+
+
+@ex.command
+def read_docs():
+    return list(read_corpus())
+
+
+@pytest.fixture
+def corpus_dir(tmp_path):
+    """A kt corpus of a plain, a gzip and a block gzip file, one per year."""
+    path = tmp_path / 'corpus'
+    (path / 'kt').mkdir(parents=True)
+    lines = make_lines(300)
+    (path / 'kt' / '2005.jsonl').write_bytes(b''.join(line + b'\n' for line in lines[:100]))
+    with gzip.open(path / 'kt' / '2006.jsonl.gz', 'wb') as f:
+        f.write(b''.join(line + b'\n' for line in lines[100:200]))
+    write_bgzf(iter(lines[200:]), path / 'kt' / '2007.jsonl.bgz', block_bytes=512)
+    return path
+
+
+def run_corpus(command, corpus_dir, **corpus_config):
+    corpus_config.update(path=str(corpus_dir), product='kt', kt_begin=2005, kt_end=2007)
+    run = ex.run(
+        command, config_updates={'corpus': corpus_config}, options={'--unobserved': True})
+    return run.result
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_parallel_read_matches_serial(corpus_dir, ordered):
+    docs = run_corpus('read_docs', corpus_dir)
+    assert docs == [json.loads(line)['paragraphs'] for line in make_lines(300)]
+    parallel_docs = run_corpus(
+        'read_docs', corpus_dir, workers=2, chunk_bytes=1024, ordered=ordered)
+    if ordered:
+        assert parallel_docs == docs
+    else:
+        assert sorted(map(json.dumps, parallel_docs)) == sorted(map(json.dumps, docs))
+
+
+def test_parallel_map_matches_serial(corpus_dir):
+    counts = run_corpus('map_count_words', corpus_dir, chunk_bytes=1024)
+    # every file is split into several chunks
+    assert len(counts) > 3
+    assert run_corpus('map_count_words', corpus_dir, workers=2, chunk_bytes=1024) == counts
+    assert sum(counts, []) == sum(run_corpus('map_count_words', corpus_dir), [])
@@ -0,0 +1,114 @@
+import gzip
+
+import numpy as np
+import pytest
+
+from run_evaluation import (
+    encode_analogies, ex, get_shape, paired_bootstrap_test, rank_analogies)
+from utils.ivf_index import IVFIndex
+from utils.vector_store import VectorStore
+from utils.word2vec_format import write_binary, write_text
+
+
+def most_similar_rank(vectors, positive, negative, targets):
+    """Rank of the best target among all words, computed like gensim's most_similar."""
+    unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1), 1e-30)[:, None]
+    mean = unit[positive].sum(axis=0) - unit[negative].sum(axis=0)
+    dists = unit @ mean
+    dists[positive + negative] = -np.inf
+    best = max(dists[t] for t in targets)
+    return 1 + np.sum(dists > best)
+
+
+@pytest.fixture
+def data():
+    rng = np.random.RandomState(0)
+    words = [f'w{i}' for i in range(300)]
+    vectors = rng.randn(len(words), 16)
+    # a zero vector must score zero instead of nan
+    vectors[7] = 0
+    analogies = []
+    for k in range(100):
+        a, b, c, d = rng.choice(len(words), size=4, replace=False)
+        if k % 10 == 0:
+            # alternative answers
+            analogies.append(('sec', (words[a], words[b], words[c], f'{words[d]}/w7')))
+        else:
+            analogies.append(('sec', (words[a], words[b], words[c], words[d])))
+    # an OOV query word and an OOV target
+    analogies.append(('sec', ('w1', 'oov', 'w2', 'w3')))
+    analogies.append(('sec', ('w1', 'w2', 'w3', 'oov')))
+    return words, vectors, analogies
+
+
+def test_rank_analogies_matches_most_similar(data):
+    words, vectors, analogies = data
+    word2index = {w: i for i, w in enumerate(words)}
+    queries, targets, oovs = encode_analogies(analogies, word2index)
+    norms = np.linalg.norm(vectors, axis=1)
+
+    ranks = rank_analogies(vectors, norms, queries, targets, batch_size=7)
+
+    for (_, (a, b, c, d)), rank, oov in zip(analogies, ranks, oovs):
+        tgts = [word2index[w] for w in d.split('/') if w in word2index]
+        if oov or not tgts:
+            assert rank == np.inf
+        else:
+            expected = most_similar_rank(
+                vectors, [word2index[a], word2index[c]], [word2index[b]], tgts)
+            assert rank == expected
+
+
+def test_rank_analogies_with_full_ivf_is_exact(data):
+    words, vectors, analogies = data
+    queries, targets, _ = encode_analogies(analogies, {w: i for i, w in enumerate(words)})
+    norms = np.linalg.norm(vectors, axis=1)
+    index = IVFIndex.build(vectors, norms, 8, rng=np.random.RandomState(0))
+
+    exact = rank_analogies(vectors, norms, queries, targets, batch_size=16)
+    approx = rank_analogies(
+        vectors, norms, queries, targets, batch_size=16, index=index, nprobe=index.n_lists)
+    np.testing.assert_array_equal(approx, exact)
+
+def test_get_shape(tmp_path):
+    words = ['satu', 'dua', 'tiga']
+    vectors = np.random.RandomState(0).randn(3, 4).astype(np.float32)
+    with open(tmp_path / 'vectors.txt', 'w', encoding='utf-8') as f:
+        write_text(f, words, vectors)
+    with gzip.open(tmp_path / 'vectors.txt.gz', 'wt', encoding='utf-8') as f:
+        write_text(f, words, vectors)
+    with open(tmp_path / 'vectors.bin', 'wb') as f:
+        write_binary(f, words, vectors)
+    VectorStore(words, vectors).save(tmp_path / 'store')
+
+    for name in ('vectors.txt', 'vectors.txt.gz', 'vectors.bin', 'store'):
+        assert get_shape(str(tmp_path / name)) == (3, 4)
+
+
+
+@ex.command
+def run_paired_bootstrap_test(samples, other_samples):
+    return paired_bootstrap_test(samples, other_samples)
+
+
+def paired_test(samples, other_samples):
+    config_updates = {
+        'seed': 0, 'n_samples': 500, 'samples': samples, 'other_samples': other_samples}
+    return ex.run(
+        'run_paired_bootstrap_test', config_updates=config_updates,
+        options={'--unobserved': True}).result
+
+
+def test_paired_bootstrap_test():
+    rng = np.random.RandomState(0)
+    samples = (rng.rand(400) < 0.6).tolist()
+
+    mean, (lo, hi), pvalue = paired_test(samples, samples)
+    assert mean == 0 and lo == hi == 0 and pvalue == 1
+
+    # the other model gets a fifth of the correct answers wrong
+    other_samples = [s and k % 5 != 0 for k, s in enumerate(samples)]
+    mean, (lo, hi), pvalue = paired_test(samples, other_samples)
+    assert mean == pytest.approx(np.mean(samples) - np.mean(other_samples))
+    assert 0 < lo < mean < hi
+    assert pvalue < 0.01
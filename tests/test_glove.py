@@ -0,0 +1,46 @@
+from pathlib import Path
+
+from run_glove import ex, get_digest, run_stage
+
+
+@ex.command
+def run_two_stages(outdir, window):
+    """Run a stage and one depending on it, returning the names of those not skipped."""
+    outdir = Path(outdir)
+    first, second = outdir / 'first.txt', outdir / 'second.txt'
+    ran = []
+
+    def make(name, output, text):
+        ran.append(name)
+        output.write_text(text)
+
+    run_stage('first', first, {'window': window}, {}, lambda: make('first', first, str(window)))
+    run_stage(
+        'second', second, {}, {'first': get_digest(first)},
+        lambda: make('second', second, first.read_text() * 2))
+    return ran
+
+
+def run_stages(outdir, **config_updates):
+    config_updates['outdir'] = str(outdir)
+    return ex.run(
+        'run_two_stages', config_updates=config_updates,
+        options={'--unobserved': True}).result
+
+
+def test_run_stage_skips_up_to_date_outputs(tmp_path):
+    assert run_stages(tmp_path, window=10) == ['first', 'second']
+    assert run_stages(tmp_path, window=10) == []
+    assert run_stages(tmp_path, window=10, force=True) == ['first', 'second']
+
+    # a new parameter reruns the stage, and so the stage depending on it
+    assert run_stages(tmp_path, window=5) == ['first', 'second']
+    assert (tmp_path / 'second.txt').read_text() == '55'
+
+    # so does an output changed outside the pipeline
+    (tmp_path / 'second.txt').write_text('changed')
+    assert run_stages(tmp_path, window=5) == ['second']
+    # rebuilding it gives an output with the same digest, so the next stage is up to date
+    (tmp_path / 'first.txt').write_text('changed')
+    assert run_stages(tmp_path, window=5) == ['first']
+    assert run_stages(tmp_path, window=5) == []
@@ -0,0 +1,61 @@
+import numpy as np
+
+from utils.ivf_index import IVFIndex, nonzero_norms, read_index_config
+
+
+def make_vectors(n=500, dim=8, seed=0):
+    vectors = np.random.RandomState(seed).randn(n, dim).astype(np.float32)
+    return vectors, np.linalg.norm(vectors, axis=1)
+
+
+def test_build_assigns_every_word():
+    vectors, norms = make_vectors()
+    index = IVFIndex.build(vectors, norms, 16, rng=np.random.RandomState(0))
+    assert index.n_lists == 16
+    assert index.assignments.shape == (len(vectors), )
+    assert index.offsets[-1] == len(vectors)
+    # every word sits at its position within its cluster
+    starts = index.offsets[index.assignments]
+    np.testing.assert_array_equal(
+        index.order[starts + index.positions], np.arange(len(vectors)))
+
+
+def test_full_probe_finds_all_neighbors():
+    vectors, norms = make_vectors()
+    index = IVFIndex.build(vectors, norms, 16, rng=np.random.RandomState(0))
+    queries = vectors[:20]
+    neighbors = np.argsort(-(queries @ vectors.T) / norms, axis=1)[:, :10]
+    assert index.recall(queries, neighbors, nprobe=index.n_lists) == 1.0
+    assert index.recall(queries, neighbors, nprobe=1) <= 1.0
+
+
+def test_rank_with_full_probe_is_exact():
+    vectors, norms = make_vectors()
+    index = IVFIndex.build(vectors, norms, 16, rng=np.random.RandomState(0))
+    queries = vectors[:5] - vectors[5:10]
+    ex_rows, ex_cols = np.arange(5), np.arange(5)
+    t_rows, t_cols = np.arange(5), np.arange(100, 105)
+
+    best, ranks = index.rank(
+        vectors, norms, queries, (ex_rows, ex_cols), (t_rows, t_cols), nprobe=index.n_lists)
+
+    dists = queries @ vectors.T / norms
+    dists[ex_rows, ex_cols] = -np.inf
+    expected_best = dists[t_rows, t_cols]
+    np.testing.assert_allclose(best, expected_best, rtol=1e-5)
+    np.testing.assert_array_equal(ranks, 1 + (dists > expected_best[:, None]).sum(axis=1))
+
+
+def test_save_and_load(tmp_path):
+    vectors, norms = make_vectors()
+    index = IVFIndex.build(vectors, norms, 16, rng=np.random.RandomState(0))
+    index.save(tmp_path / 'index', config={'n_lists': 16})
+    loaded = IVFIndex.load(tmp_path / 'index')
+    np.testing.assert_array_equal(loaded.centroids, index.centroids)
+    np.testing.assert_array_equal(loaded.assignments, index.assignments)
+    assert read_index_config(tmp_path / 'index') == {'n_lists': 16}
+    assert read_index_config(tmp_path / 'missing') is None
+
+
+def test_nonzero_norms():
+    np.testing.assert_array_equal(nonzero_norms(np.array([0., 2.])), [1., 2.])
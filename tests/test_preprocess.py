@@ -0,0 +1,45 @@
+import re
+
+import pytest
+
+from ingredients.preprocess import SentPreprocessor
+
+
+def make_prep_sent(lower=True, word_pattern=r'[\w\-]+$', map_numbers=True,
+                   number_token='@@NUM@@'):
+    # the preprocessing before SentPreprocessor, which it must match exactly
+    word_re = re.compile(word_pattern)
+    number_re = re.compile(r'\d+$')
+
+    def prep_sent(sent):
+        if lower:
+            sent = [w.lower() for w in sent]
+        sent = [w for w in sent if word_re.match(w)]
+        if map_numbers:
+            sent = [number_token if number_re.match(w) else w for w in sent]
+        return sent
+
+    return prep_sent
+
+
+TOKENS = [
+    'Kata', 'kata', 'ABC', 'foo-bar', '-', '', 'x.y', '.', 'x.', '12a', '123', '٣٤', '²',
+    'İstanbul', 'Straße', '123\n', 'Kata\n', 'a\nb', '\n', ' kata', 'kata ', '@@NUM@@',
+]
+
+
+@pytest.mark.parametrize('kwargs', [
+    {},
+    {'lower': False, 'map_numbers': False},
+    {'word_pattern': r'[a-z]+$', 'number_token': '<num>'},
+])
+@pytest.mark.parametrize('cache_size', [0, 2, 2**20])
+def test_prep_doc_matches_prep_sent(kwargs, cache_size):
+    prep_sent = make_prep_sent(**kwargs)
+    preprocessor = SentPreprocessor(cache_size=cache_size, **kwargs)
+    paras = [[TOKENS, TOKENS[::-1]], [], [TOKENS[:5]]]
+    expected = [prep_sent(sent) for para in paras for sent in para]
+    # twice, so the second time is served from the cache
+    assert preprocessor.prep_doc(paras) == expected
+    assert preprocessor.prep_doc(paras) == expected
+    assert len(preprocessor.cache) <= cache_size
@@ -0,0 +1,89 @@
+from collections import Counter
+
+import numpy as np
+
+from utils.sketches import (
+    WORD_ENTRY_BYTES, CountMinSketch, DistinctSample, FrequencySketch, HyperLogLog, hash_words)
+
+
+def make_counts(n_words=5000, n_tokens=100000, seed=0):
+    rng = np.random.RandomState(seed)
+    ids = rng.zipf(1.5, size=n_tokens) % n_words
+    return Counter(f'kata{i}' for i in ids)
+
+
+def test_hyperloglog_estimate():
+    words = [f'kata{i}' for i in range(20000)]
+    hll = HyperLogLog(precision=12)
+    hll.update(hash_words(words))
+    assert abs(hll.estimate() - len(words)) < 4 * hll.relative_error * len(words)
+
+
+def test_hyperloglog_merge_is_union():
+    a, b, union = HyperLogLog(10), HyperLogLog(10), HyperLogLog(10)
+    a.update(hash_words([f'a{i}' for i in range(3000)]))
+    b.update(hash_words([f'a{i}' for i in range(2000, 5000)]))
+    union.update(hash_words([f'a{i}' for i in range(5000)]))
+    a.merge(b)
+    np.testing.assert_array_equal(a.registers, union.registers)
+
+
+def test_count_min_sketch_bounds():
+    counts = make_counts()
+    words = list(counts)
+    cms = CountMinSketch(width=2**10, depth=4, top_n=5)
+    cms.update(words, np.array([counts[w] for w in words]))
+
+    est = cms._query(hash_words(words))
+    true = np.array([counts[w] for w in words])
+    assert cms.total == sum(counts.values())
+    assert np.all(est >= true)
+    assert np.mean(est - true <= cms.error_bound) >= cms.confidence
+    assert [w for w, _ in cms.top()] == [w for w, _ in counts.most_common(5)]
+
+
+def test_count_min_sketch_merge():
+    a_counts, b_counts = make_counts(seed=0), make_counts(seed=1)
+    a, b, both = (CountMinSketch(width=2**10, depth=4, top_n=5) for _ in range(3))
+    for cms, counts in ((a, a_counts), (b, b_counts), (both, a_counts + b_counts)):
+        words = list(counts)
+        cms.update(words, np.array([counts[w] for w in words]))
+    a.merge(b)
+    np.testing.assert_array_equal(a.table, both.table)
+    assert a.total == both.total
+    assert a.top() == both.top()
+
+
+def test_distinct_sample_estimate():
+    counts = make_counts()
+    words = list(counts)
+    exact = DistinctSample(capacity=len(words))
+    exact.update(words, np.array([counts[w] for w in words]))
+    assert exact.estimate_at_least(5) == (sum(1 for c in counts.values() if c >= 5), 0.)
+
+    sample = DistinctSample(capacity=500)
+    sample.update(words, np.array([counts[w] for w in words]))
+    assert len(sample.counts) <= 500
+    est, std_err = sample.estimate_at_least(1)
+    assert abs(est - len(counts)) < 4 * std_err
+
+
+def test_frequency_sketch_merge_matches_single_pass():
+    a_counts, b_counts = make_counts(seed=0), make_counts(seed=1)
+    kwargs = dict(hll_precision=10, cms_width=2**10, top_n=5, sample_size=500)
+    a, b, both = (FrequencySketch(**kwargs) for _ in range(3))
+    a.update(a_counts)
+    b.update(b_counts)
+    both.update(a_counts + b_counts)
+    a.merge(b)
+    assert a.hll.estimate() == both.hll.estimate()
+    assert a.cms.top() == both.cms.top()
+    assert a.sample.counts == both.sample.counts
+    assert a.sample.estimate_at_least(2) == both.sample.estimate_at_least(2)
+
+
+def test_frequency_sketch_nbytes_counts_sampled_words():
+    small = FrequencySketch(hll_precision=10, cms_width=2**10, top_n=5, sample_size=10)
+    large = FrequencySketch(hll_precision=10, cms_width=2**10, top_n=5, sample_size=1000)
+    assert small.nbytes == 2**10 + 8 * 4 * 2**10 + 20 * WORD_ENTRY_BYTES
+    assert large.nbytes - small.nbytes == 990 * WORD_ENTRY_BYTES
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from utils.vector_store import VectorStore, is_vector_store
+
+
+def make_store():
+    vectors = np.random.RandomState(0).randn(4, 3).astype(np.float32)
+    return VectorStore(['satu', 'dua', 'tiga', 'empat'], vectors)
+
+
+def test_norms_and_lookup():
+    store = make_store()
+    np.testing.assert_allclose(store.norms, np.linalg.norm(store.vectors, axis=1))
+    assert len(store) == 4
+    assert 'dua' in store and 'lima' not in store
+    assert store.word2index['tiga'] == 2
+    np.testing.assert_array_equal(store['empat'], store.vectors[3])
+
+
+def test_mismatched_lengths():
+    with pytest.raises(ValueError):
+        VectorStore(['satu'], np.zeros((2, 3)))
+
+
+def test_save_and_load(tmp_path):
+    store = make_store()
+    path = tmp_path / 'vectors.store'
+    assert not is_vector_store(path)
+    store.save(path)
+    assert is_vector_store(path)
+
+    loaded = VectorStore.load(path)
+    assert loaded.words == store.words
+    assert isinstance(loaded.vectors, np.memmap)
+    np.testing.assert_array_equal(loaded.vectors, store.vectors)
+    np.testing.assert_allclose(loaded.norms, store.norms)
+    assert not isinstance(VectorStore.load(path, mmap_mode=None).vectors, np.memmap)
@@ -0,0 +1,91 @@
+from gensim.models import FastText, Word2Vec
+import gensim
+import numpy as np
+import pytest
+
+import run_word2vec
+from run_word2vec import (
+    build_vocab_from_corpus, build_vocab_from_freq, ex, load_checkpoint, save_checkpoint)
+
+GENSIM_3 = gensim.__version__.startswith('3.')
+
+SENTENCES = [[f'kata{i % 7}', f'kata{i % 11}', f'kata{i % 13}', 'dan'] for i in range(200)]
+
+
+def make_model(build_vocab=True, min_count=1):
+    # the pinned gensim 3.x and newer versions name these arguments differently
+    kwargs = dict(size=8, iter=1) if GENSIM_3 else dict(vector_size=8, epochs=1)
+    model = Word2Vec(min_count=min_count, workers=1, seed=0, **kwargs)
+    if build_vocab:
+        model.build_vocab(SENTENCES)
+    return model
+
+
+@ex.command
+def train_and_save(checkpoint_dir, epochs):
+    model = make_model()
+    for epoch in range(epochs):
+        model.train(SENTENCES, total_examples=len(SENTENCES), epochs=1)
+        save_checkpoint(model, epoch + 1, [0.025, 0.0001])
+    return model
+
+
+def test_resume_from_checkpoint(tmp_path):
+    config_updates = {'checkpoint_dir': str(tmp_path), 'epochs': 2}
+    model = ex.run(
+        'train_and_save', config_updates=config_updates, options={'--unobserved': True}).result
+
+    # only the latest checkpoint is kept
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['checkpoint.json', 'epoch-2.model']
+    loaded, epoch, alphas = load_checkpoint(Word2Vec, tmp_path)
+    assert epoch == 2 and alphas == [0.025, 0.0001]
+    np.testing.assert_array_equal(loaded.wv.vectors, model.wv.vectors)
+
+    # the loaded model can carry on training
+    loaded.train(SENTENCES, total_examples=len(SENTENCES), epochs=1)
+    assert not np.array_equal(loaded.wv.vectors, model.wv.vectors)
+
+
+@ex.command
+def build_vocab_by_scanning():
+    model = make_model(build_vocab=False, min_count=20)
+    build_vocab_from_corpus(model, {'sentences': SENTENCES})
+    return model
+
+
+@pytest.mark.skipif(not GENSIM_3, reason='uses the gensim 3.x vocabulary API')
+def test_build_vocab_from_corpus_matches_build_vocab():
+    config_updates = {'min_count': 20}
+    model = ex.run(
+        'build_vocab_by_scanning', config_updates=config_updates,
+        options={'--unobserved': True}).result
+
+    expected = make_model(build_vocab=False, min_count=20)
+    expected.build_vocab(SENTENCES)
+    assert {w: v.count for w, v in model.wv.vocab.items()} == {
+        w: v.count for w, v in expected.wv.vocab.items()}
+    assert 'kata7' in model.wv.vocab and 'kata12' not in model.wv.vocab
+    assert model.corpus_count == expected.corpus_count == len(SENTENCES)
+    assert model.corpus_total_words == expected.corpus_total_words
+    assert model.wv.vectors.shape == expected.wv.vectors.shape
+
+
+@pytest.mark.skipif(not GENSIM_3, reason='uses the gensim 3.x vocabulary API')
+def test_build_vocab_from_corpus_checks_memory(monkeypatch):
+    monkeypatch.setattr(run_word2vec, 'get_physical_memory', lambda: 0)
+    with pytest.raises(MemoryError):
+        ex.run('build_vocab_by_scanning', options={'--unobserved': True})
+
+
+@ex.command
+def build_fasttext_vocab_from_freq(vocab_freq_path):
+    build_vocab_from_freq(FastText())
+
+
+def test_build_fasttext_vocab_from_freq_fails(tmp_path):
+    (tmp_path / 'freqs.txt').write_text('kata 10\n')
+    config_updates = {'vocab_freq_path': str(tmp_path / 'freqs.txt')}
+    with pytest.raises(ValueError):
+        ex.run(
+            'build_fasttext_vocab_from_freq', config_updates=config_updates,
+            options={'--unobserved': True})
@@ -0,0 +1,91 @@
+import gzip
+
+import numpy as np
+
+from utils.word2vec_format import (
+    read_vectors, read_vectors_header, read_vectors_words, write_binary, write_text)
+
+WORDS = ['satu', 'dua', 'tiga', 'empat', 'lima']
+
+
+def make_vectors():
+    return np.random.RandomState(0).randn(len(WORDS), 4).astype(np.float32)
+
+
+def test_read_text_words(tmp_path):
+    text = '3 2\nsatu 0.1 0.2\nNew  York -1 1\n0.5 2 3\n'
+    (tmp_path / 'vectors.txt').write_text(text, encoding='utf-8')
+    with gzip.open(tmp_path / 'vectors.txt.gz', 'wt', encoding='utf-8') as f:
+        f.write(text)
+
+    for name in ('vectors.txt', 'vectors.txt.gz'):
+        # words are split off from the right, so they can contain spaces or look like numbers
+        assert list(read_vectors_words(tmp_path / name)) == ['satu', 'New York', '0.5']
+
+
+def test_read_binary_words(tmp_path):
+    vectors = np.arange(len(WORDS) * 3, dtype=np.float32).reshape(-1, 3)
+    with open(tmp_path / 'vectors.bin', 'wb') as f:
+        f.write(f'{len(WORDS)} 3\n'.encode('utf-8'))
+        for word, vec in zip(WORDS, vectors):
+            f.write(word.encode('utf-8') + b' ' + vec.tobytes() + b'\n')
+    assert list(read_vectors_words(tmp_path / 'vectors.bin', binary=True)) == WORDS
+
+
+def test_text_round_trip(tmp_path):
+    vectors = make_vectors()
+    path = tmp_path / 'vectors.txt'
+    with open(path, 'w', encoding='utf-8') as f:
+        write_text(f, WORDS, vectors, precision=9, chunk_size=2)
+
+    assert read_vectors_header(path) == (len(WORDS), 4)
+    assert list(read_vectors_words(path)) == WORDS
+    words, vecs = zip(*read_vectors(path))
+    assert list(words) == WORDS
+    # 9 significant digits are enough to round-trip float32s
+    np.testing.assert_array_equal(np.stack(vecs), vectors)
+
+
+def test_binary_round_trip(tmp_path):
+    vectors = make_vectors()
+    path = tmp_path / 'vectors.bin'
+    with open(path, 'wb') as f:
+        write_binary(f, WORDS, vectors, chunk_size=2)
+
+    assert list(read_vectors_words(path, binary=True)) == WORDS
+    words, vecs = zip(*read_vectors(path, binary=True))
+    assert list(words) == WORDS
+    np.testing.assert_array_equal(np.stack(vecs), vectors)
+
+
+def test_gzipped_text(tmp_path):
+    vectors = make_vectors()
+    path = tmp_path / 'vectors.txt.gz'
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        write_text(f, WORDS, vectors)
+    assert list(read_vectors_words(path)) == WORDS
+    np.testing.assert_allclose(
+        np.stack([v for _, v in read_vectors(path)]), vectors, rtol=1e-5)
+
+
+def test_text_word_with_spaces(tmp_path):
+    path = tmp_path / 'vectors.txt'
+    path.write_text('1 2\nNew  York 0.5 -1\n', encoding='utf-8')
+    [(word, vec)] = read_vectors(path)
+    assert word == 'New York'
+    np.testing.assert_array_equal(vec, [0.5, -1])
+
+
+def test_read_only_given_words(tmp_path):
+    vectors = make_vectors()
+    for binary in (False, True):
+        path = tmp_path / f'vectors.{binary}'
+        if binary:
+            with open(path, 'wb') as f:
+                write_binary(f, WORDS, vectors)
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                write_text(f, WORDS, vectors, precision=9)
+        read = dict(read_vectors(path, binary=binary, words={'dua', 'lima', 'enam'}))
+        assert sorted(read) == ['dua', 'lima']
+        np.testing.assert_array_equal(read['lima'], vectors[4])
@@ -0,0 +1,196 @@
+##########################################################################
+# Copyright 2019 Kata.ai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################
+
+
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+import json
+
+import numpy as np
+
+CENTROIDS_FNAME = 'centroids.npy'
+ASSIGNMENTS_FNAME = 'assignments.npy'
+CONFIG_FNAME = 'config.json'
+
+
+def nonzero_norms(norms: np.ndarray) -> np.ndarray:
+    """Replace zero norms with one, so zero vectors stay zero when divided by them."""
+    return np.where(norms > 0, norms, 1)
+
+
+def _normalize(vectors: np.ndarray, norms: np.ndarray) -> np.ndarray:
+    return vectors / nonzero_norms(norms)[:, None]
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, batch_size: int) -> np.ndarray:
+    # scaling a vector doesn't change its most similar centroid, so it needn't be normalized
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), batch_size):
+        labels[start:start + batch_size] = np.argmax(
+            vectors[start:start + batch_size] @ centroids.T, axis=1)
+    return labels
+
+
+class IVFIndex:
+    """Inverted file index for approximate cosine similarity search over word vectors.
+
+    The words are clustered with spherical k-means and a query is only scored against the
+    words in the ``nprobe`` clusters whose centroids are the most similar to it. The index
+    stores the centroids and the cluster of each word; the vectors themselves are not
+    copied.
+    """
+
+    def __init__(self, centroids: np.ndarray, assignments: np.ndarray) -> None:
+        self.centroids = centroids
+        self.assignments = assignments
+        sizes = np.bincount(assignments, minlength=len(centroids))
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)])
+        # words sorted by cluster, and the position of every word within its cluster
+        self.order = np.argsort(assignments, kind='stable')
+        self.positions = np.empty(len(assignments), dtype=np.int64)
+        self.positions[self.order] = np.arange(len(assignments)) - self.offsets[
+            assignments[self.order]]
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(
+            cls,
+            vectors: np.ndarray,
+            norms: np.ndarray,
+            n_lists: int,
+            n_iter: int = 10,
+            train_size: Optional[int] = None,
+            rng=None,
+            batch_size: int = 2**14,
+    ) -> 'IVFIndex':
+        """Cluster the vectors with k-means trained on a random sample of them."""
+        if rng is None:
+            rng = np.random.RandomState(0)
+        n_lists = min(n_lists, len(vectors))
+        if train_size is None:
+            train_size = 256 * n_lists
+        train_size = max(n_lists, min(train_size, len(vectors)))
+
+        sample = np.sort(rng.choice(len(vectors), size=train_size, replace=False))
+        train = _normalize(np.asarray(vectors[sample]), np.asarray(norms[sample]))
+        centroids = train[rng.choice(train_size, size=n_lists, replace=False)]
+        for _ in range(n_iter):
+            labels = _assign(train, centroids, batch_size)
+            order = np.argsort(labels, kind='stable')
+            counts = np.bincount(labels, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            nonempty = counts > 0
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[nonempty]
+            sums[nonempty] = np.add.reduceat(train[order], starts, axis=0)
+            # reseed empty clusters with random training vectors
+            sums[~nonempty] = train[rng.choice(train_size, size=(~nonempty).sum())]
+            centroids = _normalize(sums, np.sqrt((sums**2).sum(axis=1)))
+
+        return cls(centroids, _assign(vectors, centroids, batch_size))
+
+    def probe(self, queries: np.ndarray, nprobe: int) -> np.ndarray:
+        """Find the ``nprobe`` clusters to search for each query."""
+        nprobe = min(nprobe, self.n_lists)
+        scores = queries @ self.centroids.T
+        return np.argpartition(-scores, nprobe - 1, axis=1)[:, :nprobe]
+
+    def _probed(self, queries: np.ndarray, nprobe: int) -> np.ndarray:
+        probed = np.zeros((len(queries), self.n_lists), dtype=bool)
+        probed[np.arange(len(queries))[:, None], self.probe(queries, nprobe)] = True
+        return probed
+
+    def rank(
+            self,
+            vectors: np.ndarray,
+            norms: np.ndarray,
+            queries: np.ndarray,
+            exclude: Tuple[np.ndarray, np.ndarray],
+            targets: Tuple[np.ndarray, np.ndarray],
+            nprobe: int = 16,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Compute the best target score and its rank among the searched words.
+
+        ``exclude`` and ``targets`` are (query row, word index) pairs of words that are
+        never returned, and of the words whose best rank is wanted, respectively. Targets
+        outside the searched clusters are not found and get a score of minus infinity.
+        """
+        probed = self._probed(queries, nprobe)
+        ex_rows, ex_cols = exclude
+        t_rows, t_cols = targets
+        ex_lists, t_lists = self.assignments[ex_cols], self.assignments[t_cols]
+
+        best = np.full(len(queries), -np.inf, dtype=queries.dtype)
+        blocks: List[Tuple[np.ndarray, np.ndarray]] = []
+        for lst in np.flatnonzero(probed.any(axis=0)):
+            rows = np.flatnonzero(probed[:, lst])
+            ids = self.order[self.offsets[lst]:self.offsets[lst + 1]]
+            scores = vectors[ids] @ queries[rows].T
+            scores /= nonzero_norms(norms[ids])[:, None]
+            # column of each query row in the scores, if this cluster is searched for it
+            cols = np.full(len(queries), -1)
+            cols[rows] = np.arange(len(rows))
+            mask = (ex_lists == lst) & (cols[ex_rows] >= 0)
+            scores[self.positions[ex_cols[mask]], cols[ex_rows[mask]]] = -np.inf
+            mask = (t_lists == lst) & (cols[t_rows] >= 0)
+            np.maximum.at(
+                best, t_rows[mask], scores[self.positions[t_cols[mask]], cols[t_rows[mask]]])
+            blocks.append((rows, scores))
+
+        n_above = np.zeros(len(queries), dtype=np.int64)
+        for rows, scores in blocks:
+            n_above[rows] += (scores > best[rows]).sum(axis=0)
+        return best, 1 + n_above
+
+    def recall(self, queries: np.ndarray, neighbors: np.ndarray, nprobe: int = 16) -> float:
+        """Compute the fraction of the true nearest neighbours the index finds.
+
+        Words in the searched clusters are scored exactly, so the index finds a true
+        neighbour if and only if it is in one of those clusters.
+        """
+        probed = self._probed(queries, nprobe)
+        rows = np.arange(len(queries))[:, None]
+        return float(probed[rows, self.assignments[neighbors]].mean())
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> 'IVFIndex':
+        path = Path(path)
+        return cls(np.load(path / CENTROIDS_FNAME), np.load(path / ASSIGNMENTS_FNAME))
+
+    def save(self, path: Union[str, Path], config: Optional[dict] = None) -> None:
+        """Save the index along with the configuration it was built with."""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / CENTROIDS_FNAME, self.centroids)
+        np.save(path / ASSIGNMENTS_FNAME, self.assignments)
+        with open(path / CONFIG_FNAME, 'w') as f:
+            json.dump(config or {}, f)
+
+
+def get_index_mtime(path: Union[str, Path]) -> float:
+    """Get when a saved index was finished, i.e. the mtime of its config (saved last)."""
+    return (Path(path) / CONFIG_FNAME).stat().st_mtime
+
+
+def read_index_config(path: Union[str, Path]) -> Optional[dict]:
+    """Read the configuration a saved index was built with, or None if there's no index."""
+    try:
+        with open(Path(path) / CONFIG_FNAME) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,247 @@
+##########################################################################
+# Copyright 2019 Kata.ai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################
+
+from functools import lru_cache
+from typing import Counter, Dict, Iterable, List, Tuple
+import hashlib
+import heapq
+import math
+
+import numpy as np
+
+# max number of word hashes memoized by each process
+HASH_CACHE_SIZE = 2**16
+# rough number of bytes a word takes in a dict or the hash cache, counting the word itself,
+# its value, and the entry
+WORD_ENTRY_BYTES = 200
+
+
+@lru_cache(maxsize=HASH_CACHE_SIZE)
+def hash_word(word: str) -> int:
+    # Python's hash() is salted per process, so it can't be used for mergeable sketches
+    digest = hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def hash_words(words: Iterable[str]) -> np.ndarray:
+    return np.array([hash_word(w) for w in words], dtype=np.uint64)
+
+
+def hash_cache_nbytes() -> int:
+    """Estimate the bytes taken by the hash cache of a process once it's full."""
+    return HASH_CACHE_SIZE * WORD_ENTRY_BYTES
+
+
+def _bit_length(x: np.ndarray) -> np.ndarray:
+    n = np.zeros(x.shape, dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        mask = x >= (np.uint64(1) << np.uint64(shift))
+        x = np.where(mask, x >> np.uint64(shift), x)
+        n += mask * shift
+    return n + (x > 0)
+
+
+class HyperLogLog:
+    """HyperLogLog estimator of the number of distinct items.
+
+    Uses 2**precision one-byte registers. The relative standard error of the estimate is
+    1.04 / sqrt(2**precision).
+    """
+
+    def __init__(self, precision: int = 14) -> None:
+        self.precision = precision
+        self.registers = np.zeros(2**precision, dtype=np.uint8)
+
+    def update(self, hashes: np.ndarray) -> None:
+        n_bits = 64 - self.precision
+        idx = (hashes >> np.uint64(n_bits)).astype(np.int64)
+        rest = hashes & np.uint64(2**n_bits - 1)
+        # position of the leftmost 1-bit in the remaining bits
+        rank = n_bits - _bit_length(rest) + 1
+        np.maximum.at(self.registers, idx, rank.astype(np.uint8))
+
+    def merge(self, other: 'HyperLogLog') -> None:
+        if other.precision != self.precision:
+            raise ValueError('cannot merge HyperLogLogs with different precisions')
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def estimate(self) -> float:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        est = alpha * m * m / np.sum(2.0**-self.registers.astype(np.float64))
+        n_zeros = np.count_nonzero(self.registers == 0)
+        if est <= 2.5 * m and n_zeros > 0:
+            # small range correction
+            est = m * math.log(m / n_zeros)
+        return float(est)
+
+
+class CountMinSketch:
+    """Count-min sketch of item frequencies with a bounded set of heavy hitters.
+
+    With probability at least 1 - exp(-depth), an estimated count exceeds the true count
+    by at most e / width times the total count. Estimates never undercount.
+    """
+
+    def __init__(self, width: int = 2**20, depth: int = 4, top_n: int = 20) -> None:
+        self.width = width
+        self.depth = depth
+        self.top_n = top_n
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+        self.heavy_hitters: Dict[str, int] = {}
+
+    def _indices(self, hashes: np.ndarray) -> np.ndarray:
+        # derive the row hashes from two 32-bit halves (Kirsch & Mitzenmacher, 2006)
+        h1 = hashes & np.uint64(0xffffffff)
+        h2 = hashes >> np.uint64(32)
+        rows = np.arange(self.depth, dtype=np.uint64)[:, None]
+        return ((h1 + rows * h2) % np.uint64(self.width)).astype(np.int64)
+
+    def _query(self, hashes: np.ndarray) -> np.ndarray:
+        idx = self._indices(hashes)
+        return self.table[np.arange(self.depth)[:, None], idx].min(axis=0)
+
+    def update(self, words: List[str], counts: np.ndarray) -> None:
+        hashes = hash_words(words)
+        idx = self._indices(hashes)
+        for row in range(self.depth):
+            np.add.at(self.table[row], idx[row], counts)
+        self.total += int(counts.sum())
+        self._update_heavy_hitters(words, self._query(hashes))
+
+    def _update_heavy_hitters(self, words: List[str], estimates: np.ndarray) -> None:
+        self.heavy_hitters.update(zip(words, estimates.tolist()))
+        # prune lazily so the candidates never exceed twice the number requested
+        if len(self.heavy_hitters) > 2 * self.top_n:
+            self.heavy_hitters = dict(self.top())
+
+    def merge(self, other: 'CountMinSketch') -> None:
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError('cannot merge count-min sketches with different shapes')
+        self.table += other.table
+        self.total += other.total
+        words = list(set(self.heavy_hitters) | set(other.heavy_hitters))
+        self.heavy_hitters = {}
+        self._update_heavy_hitters(words, self._query(hash_words(words)))
+
+    @property
+    def error_bound(self) -> float:
+        return math.e / self.width * self.total
+
+    @property
+    def confidence(self) -> float:
+        return 1 - math.exp(-self.depth)
+
+    def top(self) -> List[Tuple[str, int]]:
+        return heapq.nlargest(self.top_n, self.heavy_hitters.items(), key=lambda x: x[1])
+
+
+class DistinctSample:
+    """Exact counts of a hash-based sample of distinct items.
+
+    An item is sampled iff its hash falls below 2**-level, so all of its occurrences are
+    counted. The level goes up whenever the sample grows beyond ``capacity`` items. The
+    number of items with a count of at least k is estimated by scaling up the sample.
+    """
+
+    def __init__(self, capacity: int = 2**16) -> None:
+        self.capacity = capacity
+        self.level = 0
+        self.counts: Dict[str, int] = {}
+
+    def _threshold(self) -> int:
+        return 2**(64 - self.level)
+
+    def _subsample(self) -> None:
+        while len(self.counts) > self.capacity:
+            self.level += 1
+            threshold = self._threshold()
+            self.counts = {w: c for w, c in self.counts.items() if hash_word(w) < threshold}
+
+    def update(self, words: List[str], counts: np.ndarray) -> None:
+        threshold = self._threshold()
+        for w, c in zip(words, counts.tolist()):
+            if hash_word(w) < threshold:
+                self.counts[w] = self.counts.get(w, 0) + c
+        self._subsample()
+
+    def merge(self, other: 'DistinctSample') -> None:
+        self.level = max(self.level, other.level)
+        threshold = self._threshold()
+        counts = {w: c for w, c in self.counts.items() if hash_word(w) < threshold}
+        for w, c in other.counts.items():
+            if hash_word(w) < threshold:
+                counts[w] = counts.get(w, 0) + c
+        self.counts = counts
+        self._subsample()
+
+    def estimate_at_least(self, min_count: int) -> Tuple[float, float]:
+        """Estimate the number of items occurring at least min_count times.
+
+        Returns the estimate and its standard error.
+        """
+        rate = 2.0**-self.level
+        n_sampled = sum(1 for c in self.counts.values() if c >= min_count)
+        est = n_sampled / rate
+        # binomial sampling error, estimated from the sample itself
+        std_err = math.sqrt(n_sampled * (1 - rate)) / rate
+        return est, std_err
+
+
+class FrequencySketch:
+    """Mergeable, bounded-memory summary of word frequencies."""
+
+    def __init__(
+            self,
+            hll_precision: int = 14,
+            cms_width: int = 2**20,
+            cms_depth: int = 4,
+            top_n: int = 20,
+            sample_size: int = 2**16,
+    ) -> None:
+        self.hll = HyperLogLog(hll_precision)
+        self.cms = CountMinSketch(cms_width, cms_depth, top_n=top_n)
+        self.sample = DistinctSample(sample_size)
+
+    def update(self, counts: Counter[str]) -> None:
+        if not counts:
+            return
+        words = list(counts)
+        freqs = np.fromiter(counts.values(), dtype=np.int64, count=len(words))
+        self.hll.update(hash_words(words))
+        self.cms.update(words, freqs)
+        self.sample.update(words, freqs)
+
+    def merge(self, other: 'FrequencySketch') -> None:
+        self.hll.merge(other.hll)
+        self.cms.merge(other.cms)
+        self.sample.merge(other.sample)
+
+    @property
+    def nbytes(self) -> int:
+        """Estimate the bytes taken by the sketch once its sample is full.
+
+        This counts the registers, the count-min table, and the words of the distinct
+        sample and the heavy hitter candidates, but not the hash cache shared by all the
+        sketches of a process.
+        """
+        n_words = self.sample.capacity + 2 * self.cms.top_n
+        return self.hll.registers.nbytes + self.cms.table.nbytes + n_words * WORD_ENTRY_BYTES
@@ -0,0 +1,246 @@
+##########################################################################
+# Copyright 2019 Kata.ai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################
+
+from pathlib import Path
+from typing import Iterator, List, Sequence, Tuple, Union
+import gzip
+import json
+
+import numpy as np
+
+from utils.vector_store import VectorStore
+from utils.word2vec_format import write_text
+
+CONSONANTS = ('', 'b', 'c', 'd', 'g', 'h', 'j', 'k', 'l', 'm', 'n', 'ng', 'ny', 'p', 'r', 's',
+              't', 'w', 'y')
+VOWELS = ('a', 'i', 'u', 'e', 'o')
+CODAS = ('n', 'ng', 'k', 'r', 't', 's', 'h', 'l', 'm')
+PREFIXES = ('me', 'mem', 'men', 'meng', 'ber', 'di', 'ter', 'pe', 'pen', 'ke', 'se')
+SUFFIXES = ('kan', 'an', 'nya', 'i', 'lah', 'kah')
+# the most frequent tokens of a tokenized news corpus
+PUNCTUATION = ('.', ',', '"', '-', '(', ')', ':')
+
+Doc = List[List[List[str]]]
+
+
+def make_word(rng: np.random.RandomState) -> str:
+    """Make a random word out of Indonesian-like syllables and affixes."""
+    n_syllables = rng.choice([1, 2, 3, 4], p=[.1, .5, .3, .1])
+    word = ''.join(
+        CONSONANTS[rng.randint(len(CONSONANTS))] + VOWELS[rng.randint(len(VOWELS))]
+        for _ in range(n_syllables))
+    if rng.random_sample() < .4:
+        word += CODAS[rng.randint(len(CODAS))]
+    if rng.random_sample() < .3:
+        word = PREFIXES[rng.randint(len(PREFIXES))] + word
+    if rng.random_sample() < .2:
+        word += SUFFIXES[rng.randint(len(SUFFIXES))]
+    if rng.random_sample() < .02:
+        # reduplication, e.g. anak-anak
+        word = f'{word}-{word}'
+    return word
+
+
+def make_vocab(size: int, seed: int = 0) -> List[str]:
+    """Make a vocabulary of distinct words, ordered from the most to the least frequent.
+
+    Punctuation takes the top ranks, and a few ranks are numbers. Vocabularies made with
+    the same seed are prefixes of each other.
+    """
+    rng = np.random.RandomState(seed)
+    vocab = list(PUNCTUATION[:size])
+    seen = set(vocab)
+    while len(vocab) < size:
+        if rng.random_sample() < .02:
+            word = str(rng.randint(1, 3000))
+        else:
+            word = make_word(rng)
+        if word not in seen:
+            seen.add(word)
+            vocab.append(word)
+    return vocab
+
+
+class ZipfSampler:
+    """Sample vocabulary ranks with probability proportional to 1 / rank**exponent."""
+
+    def __init__(self, size: int, exponent: float = 1.0) -> None:
+        weights = 1 / np.arange(1, size + 1, dtype=np.float64)**exponent
+        self.cdf = np.cumsum(weights / weights.sum())
+
+    def __call__(self, rng: np.random.RandomState, n: int) -> np.ndarray:
+        ranks = np.searchsorted(self.cdf, rng.random_sample(n), side='right')
+        return np.minimum(ranks, len(self.cdf) - 1)
+
+
+def make_docs(
+        n_docs: int,
+        vocab: Sequence[str],
+        exponent: float = 1.0,
+        seed: int = 0,
+        mean_paras: float = 5.,
+        mean_sents: float = 2.,
+        mean_tokens: float = 20.,
+) -> Iterator[Doc]:
+    """Generate documents as lists of paragraphs, each a list of tokenized sentences.
+
+    Tokens are drawn from a Zipf distribution over the vocabulary. Each sentence starts
+    with a capitalized token and ends with a period.
+    """
+    rng = np.random.RandomState(seed)
+    sample = ZipfSampler(len(vocab), exponent)
+    for _ in range(n_docs):
+        n_sents = 1 + rng.poisson(mean_sents - 1, size=1 + rng.poisson(mean_paras - 1))
+        n_tokens = 1 + rng.poisson(mean_tokens - 2, size=n_sents.sum())
+        tokens = [vocab[r] for r in sample(rng, int(n_tokens.sum())).tolist()]
+
+        sents, start = [], 0
+        for n in n_tokens.tolist():
+            sent = tokens[start:start + n]
+            sent[0] = sent[0].capitalize()
+            sent.append('.')
+            sents.append(sent)
+            start += n
+
+        paras, start = [], 0
+        for n in n_sents.tolist():
+            paras.append(sents[start:start + n])
+            start += n
+        yield paras
+
+
+def write_docs(docs: Iterator[Doc], path: Union[str, Path], compress: bool = False) -> int:
+    """Write documents in the corpus JSONL format, returning the number written."""
+    n_docs = 0
+    with (gzip.open if compress else open)(path, 'wt', encoding='utf-8') as f:
+        for paras in docs:
+            print(json.dumps({'paragraphs': paras}), file=f)
+            n_docs += 1
+    return n_docs
+
+
+def write_corpus(
+        files: Sequence[Tuple[str, Path]],
+        n_docs: int,
+        vocab: Sequence[str],
+        exponent: float = 1.0,
+        seed: int = 0,
+        compress: bool = False,
+) -> None:
+    """Write n_docs documents split evenly across the given (product, path) corpus files.
+
+    The files are written as .jsonl, or .jsonl.gz if compress is true.
+    """
+    for i, (_, path) in enumerate(files):
+        path = Path(path).with_suffix('.jsonl.gz' if compress else '.jsonl')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        size = n_docs // len(files) + (i < n_docs % len(files))
+        write_docs(make_docs(size, vocab, exponent, seed=seed + i), path, compress=compress)
+
+
+def make_analogy_vectors(
+        vocab_size: int,
+        dim: int,
+        n_analogies: int,
+        n_sections: int = 4,
+        noise: float = 2.,
+        seed: int = 0,
+) -> Tuple[np.ndarray, List[Tuple[str, Tuple[int, int, int, int]]]]:
+    """Make random unit vectors where a - b + c is close to d for every analogy a b c d.
+
+    Each analogy gets its own answer word, so there can be at most vocab_size / 4 of them.
+    The larger the noise, the fewer analogies are answered correctly. Returns the vectors
+    and the (section, word indices) of the analogies.
+    """
+    if 4 * n_analogies > vocab_size:
+        raise ValueError('need at least 4 words per analogy')
+
+    rng = np.random.RandomState(seed)
+    vectors = rng.standard_normal((vocab_size, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    perm = rng.permutation(vocab_size)
+    answers, others = perm[:n_analogies], perm[n_analogies:]
+    analogies = []
+    for i, d in enumerate(answers.tolist()):
+        a = b = c = None
+        while len({a, b, c}) < 3:
+            a, b, c = others[rng.randint(len(others), size=3)].tolist()
+        v = vectors[a] - vectors[b] + vectors[c]
+        v /= np.linalg.norm(v)
+        v += noise * rng.standard_normal(dim) / np.sqrt(dim)
+        vectors[d] = v / np.linalg.norm(v)
+        analogies.append((f'section-{i % n_sections}', (a, b, c, d)))
+
+    return vectors, analogies
+
+
+def write_analogies(
+        f, analogies: Sequence[Tuple[str, Tuple[int, int, int, int]]], words: Sequence[str],
+) -> None:
+    """Write analogies of word indices in Google's format, grouped by section."""
+    for section in sorted({sec for sec, _ in analogies}):
+        f.write(f': {section}\n')
+        for _, analogy in (a for a in analogies if a[0] == section):
+            f.write(' '.join(words[i] for i in analogy) + '\n')
+
+
+def write_vectors(
+        path: Union[str, Path], words: Sequence[str], vectors: np.ndarray, precision: int = 6,
+) -> None:
+    with open(path, 'w', encoding='utf-8', buffering=2**20) as f:
+        write_text(f, words, vectors, precision=precision)
+
+
+CORPUS_DIRNAME = 'corpus'
+VECTORS_FNAME = 'vectors.txt'
+STORE_DIRNAME = 'vectors.store'
+ANALOGY_FNAME = 'analogy.txt'
+
+
+def write_dataset(
+        path: Union[str, Path],
+        years: Sequence[Tuple[str, int, int]],
+        n_docs: int = 10000,
+        vocab_size: int = 50000,
+        exponent: float = 1.0,
+        compress: bool = False,
+        vectors_vocab_size: int = 20000,
+        dim: int = 100,
+        n_analogies: int = 1000,
+        noise: float = 2.,
+        seed: int = 0,
+) -> None:
+    """Write a synthetic corpus, word vectors, and analogies under the given directory.
+
+    The corpus has a file for every (product, begin year, end year) range in years, under
+    ``corpus/<product>``. The vectors are saved both in word2vec text format and as a
+    vector store. The vectors vocabulary is a prefix of the corpus vocabulary when it's not
+    larger.
+    """
+    path = Path(path)
+    vocab = make_vocab(max(vocab_size, vectors_vocab_size), seed=seed)
+    files = [(product, path / CORPUS_DIRNAME / product / str(year))
+             for product, begin, end in years for year in range(begin, end + 1)]
+    write_corpus(files, n_docs, vocab[:vocab_size], exponent, seed=seed, compress=compress)
+
+    words = vocab[:vectors_vocab_size]
+    vectors, analogies = make_analogy_vectors(
+        len(words), dim, n_analogies, noise=noise, seed=seed)
+    write_vectors(path / VECTORS_FNAME, words, vectors)
+    VectorStore(words, vectors).save(path / STORE_DIRNAME)
+    with open(path / ANALOGY_FNAME, 'w', encoding='utf-8') as f:
+        write_analogies(f, analogies, words)
@@ -0,0 +1,85 @@
+##########################################################################
+# Copyright 2019 Kata.ai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################
+
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+VECTORS_FNAME = 'vectors.npy'
+NORMS_FNAME = 'norms.npy'
+VOCAB_FNAME = 'vocab.txt'
+
+
+class VectorStore:
+    """Word vectors stored as a raw float32 matrix that can be memory-mapped.
+
+    A store is a directory containing the vectors matrix, the precomputed L2 norm of each
+    row, and the vocabulary (one word per line, in row order).
+    """
+
+    def __init__(
+            self,
+            words: List[str],
+            vectors: np.ndarray,
+            norms: Optional[np.ndarray] = None,
+    ) -> None:
+        if len(words) != vectors.shape[0]:
+            raise ValueError('length of vectors and words mismatch')
+        if norms is None:
+            norms = np.sqrt((vectors**2).sum(axis=1))
+
+        self.words = words
+        self.vectors = vectors
+        self.norms = norms
+        self._word2index = None  # type: Optional[Dict[str, int]]
+
+    @property
+    def word2index(self) -> Dict[str, int]:
+        if self._word2index is None:
+            self._word2index = {w: i for i, w in enumerate(self.words)}
+        return self._word2index
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def __contains__(self, word: str) -> bool:
+        return word in self.word2index
+
+    def __getitem__(self, word: str) -> np.ndarray:
+        return self.vectors[self.word2index[word]]
+
+    @classmethod
+    def load(cls, path: Union[str, Path], mmap_mode: Optional[str] = 'r') -> 'VectorStore':
+        path = Path(path)
+        with open(path / VOCAB_FNAME, encoding='utf-8') as f:
+            words = f.read().split('\n')[:-1]
+        vectors = np.load(path / VECTORS_FNAME, mmap_mode=mmap_mode)
+        norms = np.load(path / NORMS_FNAME, mmap_mode=mmap_mode)
+        return cls(words, vectors, norms=norms)
+
+    def save(self, path: Union[str, Path]) -> None:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        with open(path / VOCAB_FNAME, 'w', encoding='utf-8') as f:
+            for w in self.words:
+                print(w, file=f)
+        np.save(path / VECTORS_FNAME, np.asarray(self.vectors, dtype=np.float32))
+        np.save(path / NORMS_FNAME, np.asarray(self.norms, dtype=np.float32))
+
+
+def is_vector_store(path: Union[str, Path]) -> bool:
+    return (Path(path) / VECTORS_FNAME).exists()
@@ -0,0 +1,175 @@
+##########################################################################
+# Copyright 2019 Kata.ai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################
+
+
+from functools import reduce
+from pathlib import Path
+from typing import Iterable, Iterator, List, Set, Union
+import mmap
+
+import numpy as np
+
+from utils.sketches import hash_word, hash_words
+from utils.vector_store import VectorStore, is_vector_store
+from utils.word2vec_format import open_vectors_file, read_binary_words, word_of_line
+
+WORDS_FNAME = 'words.bin'
+OFFSETS_FNAME = 'offsets.npy'
+HASHES_FNAME = 'hashes.npy'
+
+
+class VocabIndex:
+    """Set of words stored as a string table sorted by the 64-bit hash of the words.
+
+    An index is a directory containing the concatenated UTF-8 encoded words, the offset of
+    each word, and the sorted hashes. Opening one memory-maps the files, so it costs the
+    same regardless of the vocabulary size. A word is looked up by binary search on the
+    hashes, and two indexes are intersected by merging their hashes.
+    """
+
+    def __init__(self, words: Union[bytes, mmap.mmap], offsets: np.ndarray,
+                 hashes: np.ndarray) -> None:
+        if len(offsets) != len(hashes) + 1:
+            raise ValueError('length of offsets and hashes mismatch')
+        self._words = words
+        self.offsets = offsets
+        self.hashes = hashes
+
+    @classmethod
+    def build(cls, words: Iterable[str]) -> 'VocabIndex':
+        words = list(set(words))
+        hashes = hash_words(words)
+        order = np.argsort(hashes)
+        hashes = hashes[order]
+        if np.any(hashes[1:] == hashes[:-1]):
+            raise ValueError('vocabulary has words with the same hash')
+        encoded = [words[i].encode('utf-8') for i in order]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+        np.cumsum([len(w) for w in encoded], out=offsets[1:])
+        return cls(b''.join(encoded), offsets, hashes)
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def __getitem__(self, i: int) -> str:
+        return self._words[int(self.offsets[i]):int(self.offsets[i + 1])].decode('utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def find(self, word: str) -> int:
+        """Return the position of the word in the index, or -1 if it isn't there."""
+        h = np.uint64(hash_word(word))
+        i = int(np.searchsorted(self.hashes, h))
+        if i < len(self) and self.hashes[i] == h and self[i] == word:
+            return i
+        return -1
+
+    def __contains__(self, word: str) -> bool:
+        return self.find(word) >= 0
+
+    def intersection(self, *others: 'VocabIndex') -> List[str]:
+        """Return the words in this index that are in all the others.
+
+        Words are matched by hash, so two different words are taken as the same with
+        probability about n**2 / 2**64 for n words.
+        """
+        hashes = reduce(
+            lambda a, b: np.intersect1d(a, b, assume_unique=True),
+            [other.hashes for other in others],
+            self.hashes)
+        return [self[i] for i in np.searchsorted(self.hashes, hashes)]
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> 'VocabIndex':
+        path = Path(path)
+        hashes = np.load(path / HASHES_FNAME, mmap_mode='r')
+        offsets = np.load(path / OFFSETS_FNAME, mmap_mode='r')
+        with open(path / WORDS_FNAME, 'rb') as f:
+            # an empty file can't be memory-mapped
+            words = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if offsets[-1] else b''
+        return cls(words, offsets, hashes)
+
+    def save(self, path: Union[str, Path]) -> None:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        with open(path / WORDS_FNAME, 'wb') as f:
+            f.write(self._words)
+        np.save(path / OFFSETS_FNAME, self.offsets)
+        np.save(path / HASHES_FNAME, self.hashes)
+
+
+def is_vocab_index(path: Union[str, Path]) -> bool:
+    return (Path(path) / HASHES_FNAME).exists()
+
+
+def read_words(
+        path: Union[str, Path],
+        encoding: str = 'utf-8',
+        binary: bool = False,
+) -> Iterator[str]:
+    """Read the words of a vocab index, vector store, word2vec file, or vocab file.
+
+    A vocab file has one word per line. Word2vec files can be gzipped.
+    """
+    if is_vocab_index(path):
+        yield from VocabIndex.load(path)
+        return
+    if is_vector_store(path):
+        yield from VectorStore.load(path).words
+        return
+    if binary:
+        yield from read_binary_words(path, encoding=encoding)
+        return
+
+    with open_vectors_file(path, 'rt', encoding=encoding) as f:
+        first = next(f, None)
+        if first is None:
+            return
+        header = first.split()
+        if len(header) == 2 and all(x.isdigit() for x in header):
+            dim = int(header[1])
+            for line in f:
+                yield word_of_line(line, dim)
+        else:
+            yield first.strip()
+            for line in f:
+                yield line.strip()
+
+
+def read_vocab(
+        path: Union[str, Path],
+        encoding: str = 'utf-8',
+        binary: bool = False,
+) -> Union[Set[str], VocabIndex]:
+    """Open a vocab index, or read the words of any other file into a set."""
+    if is_vocab_index(path):
+        return VocabIndex.load(path)
+    return set(read_words(path, encoding=encoding, binary=binary))
+
+
+def intersect_vocabs(vocabs: List[Union[Set[str], VocabIndex]]) -> Set[str]:
+    """Find the words in all the given vocabularies, merging the indexes by hash first."""
+    indexes = [v for v in vocabs if isinstance(v, VocabIndex)]
+    sets = sorted((v for v in vocabs if not isinstance(v, VocabIndex)), key=len)
+    if indexes:
+        shared = set(indexes[0].intersection(*indexes[1:]))
+    else:
+        shared = set(sets.pop(0))
+    for vocab in sets:
+        shared.intersection_update(vocab)
+    return shared
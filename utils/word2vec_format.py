@@ -0,0 +1,176 @@
+##########################################################################
+# Copyright 2019 Kata.ai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################
+
+
+from typing import BinaryIO, Container, Iterator, List, Optional, Sequence, TextIO, Tuple
+import gzip
+
+import numpy as np
+
+# a word2vec file starts with a header line of the vocab size and the dimension, followed
+# by the words and their vectors: in the text format every line is a word and its vector
+# separated by spaces, and in the binary format every word is followed by a space and its
+# vector as raw float32s
+
+
+def open_vectors_file(path, mode: str = 'rb', encoding: Optional[str] = None):
+    open_fn = gzip.open if str(path).endswith('.gz') else open
+    return open_fn(path, mode, encoding=encoding)
+
+
+def read_header(f: BinaryIO) -> Tuple[int, int]:
+    vocab_size, dim = f.readline().split()
+    return int(vocab_size), int(dim)
+
+
+def split_line(line: str, dim: int) -> Tuple[str, List[str]]:
+    """Split a text format line into its word and vector fields from the right.
+
+    The word may contain spaces, each run of which is kept as a single space.
+    """
+    word, *fields = line.rsplit(None, dim)
+    if ' ' in word or '\t' in word:
+        word = ' '.join(word.split())
+    return word, fields
+
+
+def word_of_line(line: str, dim: int) -> str:
+    return split_line(line, dim)[0]
+
+
+def read_text_words(
+        path,
+        dim: int,
+        start: int,
+        end: int,
+        encoding: str = 'utf-8',
+) -> List[str]:
+    """Read the words of the lines starting in the byte range [start, end) of a text file."""
+    words = []
+    with open(path, 'rb') as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            words.append(word_of_line(line.decode(encoding), dim))
+    return words
+
+
+def _read_binary(path, encoding: str = 'utf-8') -> Iterator[Tuple[str, bytes]]:
+    with open_vectors_file(path) as f:
+        vocab_size, dim = read_header(f)
+        record_size = 4 * dim
+        buf, pos = b'', 0
+        for _ in range(vocab_size):
+            end = buf.find(b' ', pos)
+            while end < 0 or end + 1 + record_size > len(buf):
+                chunk = f.read(2**20)
+                if not chunk:
+                    raise ValueError(f'{path} has fewer than {vocab_size} words')
+                buf, pos = buf[pos:] + chunk, 0
+                end = buf.find(b' ')
+            # some writers end every vector with a newline
+            word = buf[pos:end].lstrip(b'\n').decode(encoding)
+            yield word, buf[end + 1:end + 1 + record_size]
+            pos = end + 1 + record_size
+
+
+def read_binary_words(path, encoding: str = 'utf-8') -> Iterator[str]:
+    """Read the words of a binary format file, skipping over the vectors."""
+    for word, _ in _read_binary(path, encoding=encoding):
+        yield word
+
+
+def read_vectors_words(path, binary: bool = False, encoding: str = 'utf-8') -> Iterator[str]:
+    """Read the words of a word2vec format file, which can be gzipped."""
+    if binary:
+        yield from read_binary_words(path, encoding=encoding)
+        return
+    with open_vectors_file(path) as f:
+        _, dim = read_header(f)
+        for line in f:
+            yield word_of_line(line.decode(encoding), dim)
+
+
+def read_vectors(
+        path,
+        binary: bool = False,
+        encoding: str = 'utf-8',
+        words: Optional[Container[str]] = None,
+) -> Iterator[Tuple[str, np.ndarray]]:
+    """Read the words and float32 vectors of a word2vec format file one at a time.
+
+    If words are given, only those words are read, and the vectors of the other words are
+    never parsed.
+    """
+    if binary:
+        for word, record in _read_binary(path, encoding=encoding):
+            if words is None or word in words:
+                yield word, np.frombuffer(record, dtype='<f4')
+        return
+    with open_vectors_file(path) as f:
+        _, dim = read_header(f)
+        for line in f:
+            word, fields = split_line(line.decode(encoding), dim)
+            if words is None or word in words:
+                yield word, np.array(fields, dtype=np.float32)
+
+
+def read_vectors_header(path) -> Tuple[int, int]:
+    with open_vectors_file(path) as f:
+        return read_header(f)
+
+
+def write_text(
+        f: TextIO,
+        words: Sequence[str],
+        vectors: np.ndarray,
+        precision: int = 6,
+        chunk_size: int = 2**12,
+) -> None:
+    """Write vectors in text format with the given number of significant digits.
+
+    Each chunk of rows is formatted by a single string formatting operation.
+    """
+    vocab_size, dim = vectors.shape
+    line_fmt = '%s' + f' %.{precision}g' * dim + '\n'
+    f.write(f'{vocab_size} {dim}\n')
+    for start in range(0, vocab_size, chunk_size):
+        chunk = vectors[start:start + chunk_size]
+        values = np.empty((len(chunk), dim + 1), dtype=object)
+        values[:, 0] = words[start:start + chunk_size]
+        values[:, 1:] = chunk
+        f.write((line_fmt * len(chunk)) % tuple(values.ravel().tolist()))
+
+
+def write_binary(
+        f: BinaryIO,
+        words: Sequence[str],
+        vectors: np.ndarray,
+        encoding: str = 'utf-8',
+        chunk_size: int = 2**12,
+) -> None:
+    """Write vectors in binary format as little-endian float32s."""
+    vocab_size, dim = vectors.shape
+    f.write(f'{vocab_size} {dim}\n'.encode(encoding))
+    for start in range(0, vocab_size, chunk_size):
+        chunk = np.ascontiguousarray(vectors[start:start + chunk_size], dtype='<f4')
+        f.write(b''.join(
+            w.encode(encoding) + b' ' + row.tobytes()
+            for w, row in zip(words[start:start + chunk_size], chunk)))
@@ -0,0 +1,35 @@
+##########################################################################
+# Copyright 2019 Kata.ai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##########################################################################
+
+from typing import Dict, Mapping
+
+# word frequency files have a word and its count per line, like GloVe's vocab_count output
+
+
+def write_word_freqs(counts: Mapping[str, int], path: str) -> None:
+    """Write word frequencies in descending order of count."""
+    with open(path, 'w', encoding='utf-8') as f:
+        for word, count in sorted(counts.items(), key=lambda x: (-x[1], x[0])):
+            print(word, count, file=f)
+
+
+def read_word_freqs(path: str) -> Dict[str, int]:
+    freqs = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            word, count = line.rstrip('\n').rsplit(' ', 1)
+            freqs[word] = int(count)
+    return freqs